@@ -38,8 +38,7 @@ class MovementAction(DirectionAction):
             raise Impossible('Blocked')
 
         # needed for fast-go
-        ent = self.map.get_blocking_entity_at_loc(loc)
-        if ent:
+        if self.map.blocked[loc.x, loc.y]:
             raise Impossible('Blocked')
         import entity
         if move:
@@ -55,7 +54,6 @@ class MovementAction(DirectionAction):
 
         return True
 
-from random import randint, random
 class MeleeAction(DirectionAction):
     def perform(self):
         cloc = self.e1.loc
@@ -66,13 +64,14 @@ class MeleeAction(DirectionAction):
 
         e1 = self.e1
         e1.wake_up_entities()
-        dmg = randint(1, 5) + e1.fighter.power()
+        rnd = self.engine.rng.combat
+        dmg = rnd.randint(1, 5) + e1.fighter.power()
         if e1.is_player:
             dmg += dmg*(10-e1.strength)
         crit = ''
-        if random()>.95:
+        if rnd.random()>.95:
             crit = ' (critical hit)'
-            dmg+= randint(1, 5)
+            dmg+= rnd.randint(1, 5)
         dfn = 5 / (5+target.fighter.defense())
 
         damage = int(round(dmg * dfn))
@@ -103,10 +102,11 @@ class BumpAction(DirectionAction):
 
 class PickupAction(Action):
    def perform(self):
+       import entity
        inv = self.e1.inventory
 
-       for item in self.engine.game_map.items():
-           if self.e1.loc==item.loc:
+       for item in self.engine.game_map.get_entities_at_loc(self.e1.loc):
+           if isinstance(item, entity.Item):
                if len(inv.items) >= inv.capacity:
                    raise Impossible('Your inventory is full.')
 
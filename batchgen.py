@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Generate many levels in a process pool and report generator throughput and statistics.
+
+    ./batchgen.py --seeds 0:500 --depths 1:10 --workers 4
+
+Levels the generator fails on are listed by error with their (seed, depth), and the exit status is then 1.
+"""
+import io
+import os
+import sys
+import time
+import pickle
+import argparse
+from collections import Counter
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np  # type: ignore
+
+import entity
+import engine as E
+import procgen
+from pregen import StubEngine
+from rng import RNG
+
+
+def generate(seed, depth):
+    """Generate the level at `depth` (1 is the top level) for world `seed`; returns generation time in seconds, number
+    of rooms, rooms rejected by reason, bytes of the map's arrays and of the pickled map. Raises what the generator
+    raises."""
+    player = entity.Player(None, E.map_width // 2, E.map_height // 2)
+    engine = StubEngine(depth - 1, depth - 1, E.Engine.max_levels, {}, player, RNG(seed))
+    engine.rng.start_level(str(depth))
+    procgen.rejected_rooms.clear()
+    with redirect_stdout(io.StringIO()):
+        t = time.perf_counter()
+        m = procgen.generate_dungeon(E.max_rooms, E.room_min_size, E.room_max_size, E.map_width, E.map_height,
+                                     player, engine, None)
+        t = time.perf_counter() - t
+    arrays = m.tiles.nbytes + m.visible.nbytes + m.explored.nbytes
+    pickled = len(pickle.dumps(m, pickle.HIGHEST_PROTOCOL))
+    return t, len(m.rooms), dict(procgen.rejected_rooms), arrays, pickled
+
+def generate_batch(jobs):
+    """Generate the levels of `jobs`; returns a list of (seed, depth, results of `generate()` or the exception message
+    if the generator failed)."""
+    results = []
+    for seed, depth in jobs:
+        try:
+            results.append((seed, depth, generate(seed, depth)))
+        except Exception as e:
+            results.append((seed, depth, f'{type(e).__name__}: {e}'))
+    return results
+
+
+def parse_range(s):
+    a, _, b = s.partition(':')
+    return range(int(a), int(b)) if b else range(int(a), int(a) + 1)
+
+def batch(seeds, depths, workers, chunk=50):
+    jobs = [(seed, depth) for seed in seeds for depth in depths]
+    chunks = [jobs[i:i+chunk] for i in range(0, len(jobs), chunk)]
+    t = time.perf_counter()
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            results = [r for rs in pool.map(generate_batch, chunks) for r in rs]
+    else:
+        results = generate_batch(jobs)
+    return results, time.perf_counter() - t
+
+def report(results, elapsed, workers, file=sys.stdout, max_failed=20):
+    """Print statistics of the generated levels, then the failed ones by error; returns the number of failed levels."""
+    failed = [(seed, depth, r) for seed, depth, r in results if isinstance(r, str)]
+    results = [r for _, _, r in results if not isinstance(r, str)]
+    n = len(results)
+    print(f'{n} levels in {elapsed:.2f}s with {workers} workers, {n/elapsed:.0f} levels/sec', file=file)
+    if n:
+        times = np.array([r[0] for r in results]) * 1000
+        rooms = np.array([r[1] for r in results])
+        rejected = Counter()
+        for r in results:
+            rejected.update(r[2])
+        arrays = np.array([r[3] for r in results])
+        pickled = np.array([r[4] for r in results])
+        print('generation time (ms): ' + '  '.join(f'p{p} {np.percentile(times, p):.2f}' for p in (50, 90, 99))
+              + f'  max {times.max():.2f}', file=file)
+        print(f'rooms per level: mean {rooms.mean():.2f}, min {rooms.min()}, max {rooms.max()}', file=file)
+        rejected = ', '.join(f'{k} {v/n:.2f}' for k, v in sorted(rejected.items())) or 'none'
+        print(f'rejected rooms per level: {rejected}', file=file)
+        print(f'memory per map: arrays {arrays.mean():.0f} bytes, pickled mean {pickled.mean():.0f} bytes, '
+              f'max {pickled.max()} bytes', file=file)
+    if failed:
+        print(f'failed levels: {len(failed)}', file=file)
+        for msg, count in Counter(r for _, _, r in failed).most_common():
+            pairs = [(seed, depth) for seed, depth, r in failed if r == msg]
+            more = f' and {len(pairs) - max_failed} more' if len(pairs) > max_failed else ''
+            print(f'  {count} x {msg}; (seed, depth): ' + ', '.join(map(str, pairs[:max_failed])) + more, file=file)
+    return len(failed)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seeds', default='0:200', help='range of world seeds, start:stop')
+    parser.add_argument('--depths', default='1:11', help='range of depths, start:stop')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    results, elapsed = batch(parse_range(args.seeds), parse_range(args.depths), args.workers)
+    if report(results, elapsed, args.workers):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""Benchmarks, run with: ./bench.py [name ...]"""
+import sys
+import os
+import json
+import io
+import tempfile
+import shutil
+from contextlib import redirect_stdout
+from timeit import timeit
+import numpy as np  # type: ignore
+
+import tile_types
+from util import Loc
+from game_map import GameMap, save_custom_maps, load_custom_maps, load_json_custom_maps
+
+LEGACY_MAPS = 'custom_maps.dat'
+MAPS = 'custom_maps.npz'
+SEED = 1    # world seed of benchmark games
+
+
+def report(name, seconds, number):
+    print(f'{name:40} {seconds/number*1000:10.3f} ms')
+
+class NumpyEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        return super().default(obj)
+
+def save_json_custom_maps(filename, maps):
+    """The old format: each map dumped to JSON and wrapped in another JSON document."""
+    d = {}
+    for n, m in maps.items():
+        st = [tuple(s.loc) if s else None for s in (m.up, m.left, m.right)]
+        d[n] = json.dumps(dict(width=m.width, height=m.height, tiles=m.tiles, up=st[0], left=st[1], right=st[2]), cls=NumpyEncoder)
+    with open(filename, 'w') as f:
+        f.write(json.dumps(d))
+
+def load_json_cells(jdata):
+    """The old JSON loader that converted one cell at a time, for comparison."""
+    d = json.loads(jdata)
+    tiles = np.full((d['width'], d['height']), fill_value=tile_types.wall, order="F")
+    for p,r in enumerate(d['tiles']):
+        for q,(a,b,c,dk) in enumerate(r):
+            tiles[p,q] = np.array((a,b,tuple(c),tuple(dk)), dtype=tile_types.tile_dt)
+    return tiles
+
+def bench_json_load(number=20):
+    with open(LEGACY_MAPS) as f:
+        data = json.loads(f.read())
+    for jdata in data.values():
+        assert (load_json_cells(jdata) == GameMap.load_json(jdata).tiles).all()
+    report('legacy json maps: per-cell load', timeit(lambda: [load_json_cells(j) for j in data.values()], number=number), number)
+    report('legacy json maps: bulk load', timeit(lambda: [GameMap.load_json(j) for j in data.values()], number=number), number)
+
+def bench_maps(number=20):
+    maps = load_json_custom_maps(LEGACY_MAPS)
+    with tempfile.TemporaryDirectory() as d:
+        json_fn = os.path.join(d, 'maps.dat')
+        npz_fn = os.path.join(d, 'maps.npz')
+        report('custom maps: write json', timeit(lambda: save_json_custom_maps(json_fn, maps), number=number), number)
+        report('custom maps: write npz', timeit(lambda: save_custom_maps(npz_fn, maps), number=number), number)
+        report('custom maps: load json', timeit(lambda: load_json_custom_maps(json_fn), number=number), number)
+        report('custom maps: load npz', timeit(lambda: load_custom_maps(npz_fn), number=number), number)
+        print(f'custom maps: size json {os.path.getsize(json_fn)} bytes, npz {os.path.getsize(npz_fn)} bytes')
+
+def descend(engine, levels):
+    """Take the stairs down `levels` times (or while there are stairs)."""
+    with redirect_stdout(io.StringIO()):
+        for _ in range(levels):
+            m = engine.game_map
+            st = m.left or m.right
+            if not st:
+                break
+            engine.player.loc = st.loc
+            engine.down()
+
+def bench_save(number=5):
+    from engine import new_game
+    with redirect_stdout(io.StringIO()):
+        engine = new_game(MAPS, SEED)[0]
+    with tempfile.TemporaryDirectory() as d:
+        maps_fn = os.path.join(d, MAPS)
+        fn = os.path.join(d, 'game.sav')
+        for levels in (1, 10, 20):
+            descend(engine, levels - len(list(engine.tree)))
+            def full_save():
+                shutil.rmtree(fn, ignore_errors=True)
+                engine.journal.filename = None
+                engine.save_as(fn, maps_fn)
+            report(f'save, {len(list(engine.tree))} levels: full', timeit(full_save, number=number), number)
+            report(f'save, {len(list(engine.tree))} levels: incremental', timeit(lambda: engine.save_as(fn, maps_fn), number=number), number)
+
+def crowded_game(monsters):
+    """New game with `monsters` orcs that can all see the player."""
+    from engine import new_game
+    from procgen import spawn
+    import entity
+    with redirect_stdout(io.StringIO()):
+        engine = new_game(MAPS, SEED)[0]
+        rnd = engine.rng.stream('bench')
+        m = engine.game_map
+        f = engine.player.fighter
+        f.max_hp = f.hp = 10**9
+        floor = [Loc(x, y) for x, y in np.argwhere(m.tiles['walkable']).tolist()]
+        spawned = 0
+        for loc in rnd.sample(floor, len(floor)):
+            if spawned == monsters:
+                break
+            if m.empty(loc):
+                spawn(entity.Orc, m, engine, loc).asleep = 0
+                spawned += 1
+        assert spawned == monsters, spawned
+    m.visible[:] = True
+    return engine
+
+def bench_enemies(number=200):
+    for monsters in (10, 50, 200):
+        engine = crowded_game(monsters)
+        def turn():
+            engine.player.ap = 0
+            engine.handle_enemy_turns()
+        with redirect_stdout(io.StringIO()):
+            t = timeit(turn, number=number)
+        report(f'enemy turn, {monsters} monsters', t, number)
+
+def bench_render(number=500):
+    import tcod
+    from engine import new_game
+    from game_map import RenderCache
+    with redirect_stdout(io.StringIO()):
+        engine = new_game(MAPS, SEED)[0]
+    for i in range(30):
+        engine.messages.add(f'message {i}, long enough to be wrapped over more than one line of the log panel')
+    console = tcod.console.Console(engine.screen_width, engine.screen_height, order='F')
+    m = engine.game_map
+    def uncached():
+        engine.render_cache = RenderCache()
+        m.render(engine, console)
+    report('map render, nothing changed', timeit(lambda: m.render(engine, console), number=number), number)
+    report('map render, from scratch', timeit(uncached, number=number), number)
+
+def bench_loc(number=200):
+    """Loc operations, timed over 1000 locations per run."""
+    import random
+    rnd = random.Random(SEED)
+    locs = [Loc(rnd.randrange(80), rnd.randrange(50)) for _ in range(1000)]
+    others = [Loc(l.x, l.y) for l in locs]
+    shuffled = rnd.sample(locs, len(locs))
+    tuples = [tuple(l) for l in locs]
+    in_set = set(locs[::2])
+    mod = Loc(1, -1)
+    for name, f in (('hash', lambda: [hash(l) for l in locs]),
+                    ('equal', lambda: [a == b for a, b in zip(locs, others)]),
+                    ('not equal', lambda: [a == b for a, b in zip(locs, shuffled)]),
+                    ('equal to tuple', lambda: [a == b for a, b in zip(locs, tuples)]),
+                    ('set membership', lambda: [l in in_set for l in others]),
+                    ('build set', lambda: set(locs)),
+                    ('adj', lambda: [l.adj() for l in locs]),
+                    ('adj_locs', lambda: [l.adj_locs() for l in locs]),
+                    ('dist', lambda: [a.dist(b) for a, b in zip(locs, shuffled)]),
+                    ('mod', lambda: [l.mod(1, 0) for l in locs]),
+                    ('add', lambda: [l + mod for l in locs]),
+                    ('sort', lambda: sorted(shuffled))):
+        report(f'loc x1000: {name}', timeit(f, number=number), number)
+
+
+benchmarks = dict(maps=bench_maps, json_load=bench_json_load, save=bench_save, enemies=bench_enemies, render=bench_render,
+                  loc=bench_loc)
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or benchmarks:
+        benchmarks[name]()
@@ -1,20 +1,62 @@
-import re
-from random import shuffle, randint, random
-import lzma, pickle
+import os
+from collections import OrderedDict
 import tcod
-import json
-import binarytree
 from tcod.map import compute_fov
-from game_map import MessageLog, GameMap
+from game_map import MessageLog, RenderCache, save_custom_maps, load_custom_maps, load_json_custom_maps
 from util import Loc
+from rng import RNG
 from actions import Impossible
 import entity
 from procgen import generate_dungeon, generate_special_dungeon
+import savegame
+from pregen import Pregenerator
+from hibernate import Hibernator
+from level_tree import LevelTree
 from input_handlers import EventHandler, MainMenu
 import libtcodpy
 
 screen_width = 80
 screen_height = 50
+map_width = 80
+map_height = screen_height - 5
+room_max_size = 10
+room_min_size = 6
+max_rooms = 5
+
+
+class FovCache:
+    """Recent fields of view on the current map by player location, dropped when the map or its tiles change; kept on
+    the Engine, but not saved."""
+    size = 32
+
+    def __init__(self):
+        self.game_map = self.tiles_version = self.key = None
+        self.results = OrderedDict()
+
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def update(self, m, loc):
+        """Update `visible` and `explored` of map `m` for the player at `loc`."""
+        if m is not self.game_map or m.tiles_version != self.tiles_version:
+            self.game_map, self.tiles_version, self.key = m, m.tiles_version, None
+            self.results.clear()
+        key = loc.x, loc.y, m.reveal
+        if key == self.key:
+            return
+        self.key = key
+        fov = self.results.get(key)
+        if fov is None:
+            fov = self.results[key] = compute_fov(m.tiles["transparent"], loc, radius=8, algorithm=libtcodpy.FOV_SYMMETRIC_SHADOWCAST)
+            if len(self.results) > self.size:
+                self.results.popitem(last=False)
+        else:
+            self.results.move_to_end(key)
+        m.visible[:] = fov
+        m.explored |= fov
 
 
 class Engine:
@@ -24,186 +66,107 @@ class Engine:
     event_handler = None
     total_levels = 0
     max_levels = 25
+    time = 0        # number of turns of the player
     screen_width = screen_width
     screen_height = screen_height
 
-    def __init__(self, player):
+    def __init__(self, player, seed=None):
         self.player = player
+        self.rng = RNG(seed)
         self.messages = MessageLog()
         self.mouse_loc = Loc(0,0)
         self.level = 0
-        n = list(range(1,100))
-        shuffle(n)
-        self.node_nums = n
-        self.tree = binarytree.Node(self.node_nums.pop())
-        self.cur_node = self.tree
-        self.cur_node.parent = None
+        self.tree = LevelTree()
+        self.cur_node = 0   # id of the current level in `tree`
         self.specials = {}
         self.quests = {}
         self.custom_maps = {}
+        self.journal = savegame.SaveJournal()
+        self.pregen = Pregenerator()
+        self.hibernator = Hibernator()
+        self.render_cache = RenderCache()
+        self.fov_cache = FovCache()
 
-    def incomplete_nodes(self, node, lst):
-        """Nodes that have stairs but respective game-maps were not yet generated."""
-        if not node:
-            return
-        if node.left:
-            self.incomplete_nodes(node.left.game_map, lst)
-        if node.right:
-            self.incomplete_nodes(node.right.game_map, lst)
-        node.incomplete_left = node.incomplete_right = False
-        if node.left and not node.left.game_map:
-            node.incomplete_left = True
-            lst.append(node)
-        if node.right and not node.right.game_map:
-            node.incomplete_right = True
-            lst.append(node)
-
-    def show_tree(self):
-        s = str(self.tree)
-        s = s.split('\n')
-        s2 = []
-        node = self.cur_node
-        node_pat = r'[^\d]{}[^\d]'
-
-        for l in s:
-            l = ' '+l+' '
-            mt = re.search(node_pat.format(node.value), l)
-            if mt:
-                l = [''] + list(l)
-                l.extend(('',''))
-                try: l[mt.start()+1] = '*'
-                except IndexError: pass
-                try: l[mt.end()] = '*'
-                except IndexError: pass
-                l = ''.join(l)
-            s2.append(l)
-
-        incomplete = []
-        self.incomplete_nodes(self.root_map, incomplete)
-        incomplete = set(incomplete)
-        incomplete_nodes = []
-        for n in list(self.tree):
-            if n.game_map in incomplete:
-                incomplete_nodes.append(n)
-        for n, l in enumerate(s2):
-            for node in incomplete_nodes:
-                mt = re.search(node_pat.format(node.value), l)
-                if mt:
-                    s = s2[n+1] + ' '*100
-                    s = list(s)
-                    f = mt.start()+1
-                    if node.game_map.incomplete_left:
-                        if s[f] == ' ':
-                            s[f] = '/'
-                        elif s[f-1]==' ':
-                            s[f-1] = '/'
-                    if node.game_map.incomplete_right:
-                        if s[f] == ' ':
-                            s[f] = '\\'
-                        elif s[f+1]==' ':
-                            s[f+1] = '\\'
-
-                    s = ''.join(s).rstrip()
-                    s2[n+1] = s
-
-        return s2
+    def level_key(self, lid, down_dir=None):
+        """Path of level `lid` (or of its child below `down_dir` stairs) from the root of the level tree."""
+        return self.tree.path(lid, down_dir)
 
     def down(self):
         self.level += 1     # new_map depends on this
+        self.journal.level_changed(self.cur_node)
         m = self.game_map
+        m.left_at = self.time
         st = m.get_down_map(self.player.loc)
+        m.entities.discard(self.player)   # only the current level indexes the player and their moves
         if st.game_map:
             m = st.game_map
-            self.cur_node = getattr(self.cur_node, st.down_dir)
+            self.cur_node = self.tree.child(self.cur_node, st.down_dir)
         else:
-            m = st.game_map = new_map(self, self.player, m)
-            node = binarytree.Node(self.node_nums.pop())
-            setattr(self.cur_node, st.down_dir, node)
-            node.parent = self.cur_node
-            self.cur_node = node
+            m = st.game_map = self.pregen.adopt(self, st) or new_map(self, self.player, m, self.level_key(self.cur_node, st.down_dir))
+            self.cur_node = self.tree.add(self.cur_node, st.down_dir, m)
 
         self.player.loc = m.up.loc
-        self.game_map = self.cur_node.game_map = m
-        self.show_tree()
+        self.game_map = m
+        m.entities.add(self.player)
+        self.hibernator.update(self)
+        m.catch_up(self)
+        self.pregen.schedule(self)
 
     def up(self):
         self.level -= 1
+        self.journal.level_changed(self.cur_node)
         up = self.game_map.up
+        self.game_map.left_at = self.time
+        self.game_map.entities.discard(self.player)
         self.game_map = self.game_map.up.game_map
         self.event_handler.game_map = self.game_map
         self.player.loc = up.above_loc
-        self.cur_node = self.cur_node.parent
-        self.show_tree()
+        self.game_map.entities.add(self.player)
+        self.cur_node = self.tree.parent[self.cur_node]
+        self.hibernator.update(self)
+        self.game_map.catch_up(self)
+        self.pregen.schedule(self)
 
     # for e in self.game_map.entities - {self.player}:
 
     def handle_enemy_turns(self):
         if self.player.ap >= 1:
             return
-        for e in self.game_map.entities:
-            if isinstance(e, entity.Living):
-                e.ap += e.speed
-
-        for e in self.game_map.entities.copy():
-            if not isinstance(e, entity.Living):
-                continue
-            if e.levitating:
-                e.levitating -= 1
-                if not e.levitating:
-                    e.vloc = 0
-                    self.messages.add(f'{e} floats down')
-
-            if e.asleep > 0:
-                e.asleep -= 1
-                if not e.asleep:
-                    self.messages.add(f'{e} wakes up')
-
-            if e.blinded > 0:
-                e.blinded -= 1
-                if not e.blinded:
-                    self.messages.add(f'{e} can see again')
-
-            if e.paralized > 0:
-                e.paralized -= 1
-                if not e.paralized:
-                    self.messages.add(f'{e} can move again')
-
-            if e.poisoned > 0:
-                e.poisoned -= 1
-                dmg = randint(2,6)
-                e.fighter.take_damage(dmg)
-                self.messages.add(f'{e} takes {dmg}hp damage from poison')
-                if random()>0.999:
-                    self.messages.add(f'{e} dies of poison')
-                    e.fighter.die()
-                if not e.poisoned and e.is_alive:
-                    self.messages.add(f'{e} feels better')
-
-            if e.turning_to_stone > 0:
-                e.turning_to_stone -= 1
-                if e.turning_to_stone:
-                    self.messages.add(f'{e} is turning to stone ...')
-                else:
-                    self.messages.add(f'{e} is now STONE ...')
-                    e.fighter.die()
-
-        for e in self.game_map.entities - {self.player}:
-            for _ in range(3):
-                if e.is_hostile and e.asleep==0 and e.paralized==0 and e.ap>=1:
-                    a = e.attack(self.player)
-                    if a:
-                        try:
-                            a.perform()
-                        except Impossible:
-                            pass
-                if isinstance(e, entity.Living) and e.ap>=1:
-                    e.ap = max(0, e.ap-1)
+        self.game_map.distance_fields = None
+        self.player.ap += self.player.speed
+        self.time += 1
+
+        self.game_map.update_statuses(self)
+        now = self.time
+        entities = self.game_map.entities
+
+        # entities with speed `s` take turns `1/s` apart; a new one starts with no energy (see `EntitySet.add()`), one that
+        # was on a level the player has left starts the current turn with no energy
+        while True:
+            e = entities.due(now)
+            if not e:
+                break
+            t = e.next_turn
+            if t is None or t <= now - 1:
+                t = e.next_turn = now - 1 + 1/e.speed
+                if t > now:
+                    entities.schedule(e)
+                    continue
+            if e.is_hostile and e.asleep==0 and e.paralized==0:
+                a = e.attack(self.player)
+                if a:
+                    try:
+                        a.perform()
+                    except Impossible:
+                        pass
+            e.next_turn = t + 1/e.speed
+            entities.schedule(e)
+        self.game_map.distance_fields = None
 
     def update_fov(self):
-        """Recompute the visible area based on the players point of view."""
-        loc = self.player.loc
-        self.game_map.visible[:] = compute_fov(self.game_map.tiles["transparent"], loc, radius=8, algorithm=libtcodpy.FOV_SYMMETRIC_SHADOWCAST)
-        self.game_map.explored |= self.game_map.visible
+        """Recompute the visible area based on the players point of view, unless the player and the map haven't changed
+        since the last time."""
+        self.fov_cache.update(self.game_map, self.player.loc)
 
     def render(self, console=None, context=None):
         console = console or self.console
@@ -224,20 +187,17 @@ class Engine:
         console.clear()
 
     def save_as(self, filename, maps_filename):
-        save_data = lzma.compress(pickle.dumps(self))
-        with open(filename, "wb") as f:
-            f.write(save_data)
-        d = {}
-        for n, map in self.custom_maps.items():
-            d[n] = map.serialize()
-        with open(maps_filename, "w") as f:
-            f.write(json.dumps(d))
+        savegame.save(self, filename)
+        save_custom_maps(maps_filename, self.custom_maps)
 
-    def load_custom_maps(self, data):
-        d = {}
-        for n, jdata in data.items():
-            d[n] = GameMap.load(jdata)
-        return d
+    def load_custom_maps(self, maps_filename):
+        """Load custom maps; on first use, convert the old JSON `.dat` file next to `maps_filename`."""
+        legacy_filename = os.path.splitext(maps_filename)[0] + '.dat'
+        if not os.path.exists(maps_filename) and os.path.exists(legacy_filename):
+            save_custom_maps(maps_filename, load_json_custom_maps(legacy_filename))
+        if not os.path.exists(maps_filename):
+            return {}
+        return load_custom_maps(maps_filename)
 
 
 def start():
@@ -247,14 +207,14 @@ def start():
     MainMenu(engine)
     return engine, screen_width, screen_height, tileset
 
-def new_game(maps_filename):
-    """Return a brand new game session as an Engine instance."""
+def new_game(maps_filename, seed=None):
+    """Return a brand new game session as an Engine instance; the same `seed` gives the same dungeon."""
     tileset = tcod.tileset.load_tilesheet( "dejavu10x10_gs_tc.png", 32, 8, tcod.tileset.CHARMAP_TCOD)
     player = entity.Player(None, int(screen_width / 2), int(screen_height / 2))
-    engine = Engine(player=player)
+    engine = Engine(player=player, seed=seed)
     game_map = new_map(engine, player)
     engine.game_map = game_map
-    engine.cur_node.game_map = engine.root_map = game_map
+    engine.tree.set_map(engine.cur_node, game_map)
     player.add_engine(engine)
     player.inventory.add(entity.FireballScroll(engine))
     player.inventory.add(entity.EyeOfIceScroll(engine))
@@ -270,40 +230,39 @@ def new_game(maps_filename):
     player.inventory.add(entity.SwordOfRingingBell(engine, entity=player))
     EventHandler(engine)
     engine.update_fov()
-    with open(maps_filename, 'r') as f:
-        engine.custom_maps = engine.load_custom_maps(json.loads(f.read()))
+    engine.custom_maps = engine.load_custom_maps(maps_filename)
+    engine.pregen.schedule(engine)
     return engine, screen_width, screen_height, tileset
 
-def new_map(engine, player, up_map=None):
-    map_width = 80
-    map_height = screen_height - 5
-    room_max_size = 10
-    room_min_size = 6
-    max_rooms = 5
+def new_map(engine, player, up_map=None, key=''):
+    """Generate the level at path `key` of the level tree."""
     level = engine.level + 1
-    special_levels = entity.special_data.levels.get(level) or ()
-    if special_levels:
-        shuffle(special_levels)
-    special = False
-    for special_level in special_levels:
-        if special_level.id not in engine.specials:
-            dungeon = generate_special_dungeon(max_rooms, room_min_size, room_max_size, map_width, map_height, player, engine, up_map, special_level)
-            engine.specials[special_level.id] = dungeon
-            special = True
-            break
-    if not special:
-        dungeon = generate_dungeon(max_rooms, room_min_size, room_max_size, map_width, map_height, player, engine, up_map)
+    engine.rng.start_level(key)
+    try:
+        special_levels = list(entity.special_data.levels.get(level) or ())
+        engine.rng.map.shuffle(special_levels)
+        special = False
+        for special_level in special_levels:
+            if special_level.id not in engine.specials:
+                dungeon = generate_special_dungeon(max_rooms, room_min_size, room_max_size, map_width, map_height, player, engine, up_map, special_level)
+                engine.specials[special_level.id] = dungeon
+                special = True
+                break
+        if not special:
+            dungeon = generate_dungeon(max_rooms, room_min_size, room_max_size, map_width, map_height, player, engine, up_map)
+    finally:
+        engine.rng.end_level()
     return dungeon
 
 def load_game(filename, maps_filename):
-    with open(filename, 'rb') as f:
-        engine = pickle.loads(lzma.decompress(f.read()))
+    engine = savegame.load(filename)
     assert isinstance(engine, Engine)
-    with open(maps_filename, 'r') as f:
-        engine.custom_maps = engine.load_custom_maps(json.loads(f.read()))
-        print("engine.custom_maps", list(engine.custom_maps))
+    engine.custom_maps = engine.load_custom_maps(maps_filename)
+    print("engine.custom_maps", list(engine.custom_maps))
+    engine.hibernator.update(engine)
     # engine.player.blinded = 3
     p = engine.player
     p.gold = 200
     p.inventory.add(entity.RingOfFreeAction(engine, entity=p))
+    engine.pregen.schedule(engine)
     return engine
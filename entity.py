@@ -2,13 +2,12 @@ from collections import defaultdict
 import time
 from enum import Enum, auto
 import tcod
-from random import choice, random, randint
 import input_handlers
-import numpy as np
 from util import Loc
 from actions import WaitAction, MovementAction, MeleeAction, Impossible, BumpAction
 from game_map import Color
 from entity_components import Equipment, CharLevel, Inventory, Fighter
+from status_effects import Levitating, Asleep, Blinded, Paralized, Poisoned, TurningToStone
 
 """
 TODO
@@ -39,7 +38,11 @@ class Entity:
     render_order = 1
     is_player = False
     blocking = False
-    loc = None
+    speed = 0           # turns per turn of the player; entities without speed don't act
+    next_turn = None    # game time of the next turn, see `Engine.handle_enemy_turns()`
+    statuses = {}       # status name => expiry time, see `status_effects`
+    _location = None
+    _entity_sets = ()   # `EntitySet`s this entity belongs to
     level = None
     name = None
     entity = None
@@ -85,20 +88,35 @@ class Entity:
     def __str__(self):
         return self.char
 
+    @property
+    def loc(self):
+        return self._location
+
+    @loc.setter
+    def loc(self, loc):
+        old = self._location
+        self._location = loc
+        for s in self._entity_sets:
+            s.moved(self, old)
+
+    def blocking_changed(self):
+        for s in self._entity_sets:
+            s.update_blocking(self)
+
+    def render_order_changed(self):
+        for s in self._entity_sets:
+            s.update_render_order(self)
+
+    def status_changed(self, name):
+        for s in self._entity_sets:
+            s.schedule_status(self, name)
+
     def move(self, mod):
         self.loc += mod
 
     def get_path_to(self, loc):
         """Compute and return a path to the target position or empty list."""
-        game_map = self.engine.game_map
-        cost = np.array(game_map.tiles["walkable"], dtype=np.int8)
-
-        for entity in game_map.entities:
-            eloc = entity.loc
-            if entity.blocking and cost[eloc.x, eloc.y]:
-                # Add to the cost of a blocked position.  A lower number means more enemies will crowd behind each other
-                # in hallways.  A higher number means enemies will take longer paths in order to surround the player.
-                cost[eloc.x, eloc.y] += 10
+        cost = self.engine.game_map.path_cost()
 
         # Create a graph from the cost array and pass that graph to a new pathfinder.
         graph = tcod.path.SimpleGraph(cost=cost, cardinal=2, diagonal=3)
@@ -148,14 +166,15 @@ class Living(Blocking):
     render_order = 3
     gold = 0
     gen_companions = None
-    levitating = 0
-    asleep = 0
-    paralized = 0
-    poisoned = 0
-    turning_to_stone = 0
-    blinded = 0
+    levitating = Levitating()
+    asleep = Asleep()
+    paralized = Paralized()
+    poisoned = Poisoned()
+    turning_to_stone = TurningToStone()
+    blinded = Blinded()
     damage_type = None
     ap = 0  # action points
+    wanders = True  # moves around on a level the player has left, see `GameMap.catch_up()`
     spells = None
     haste_spell = None
     special_attack = None
@@ -223,7 +242,7 @@ class Hostile(Living):
         self.handle_equipment()
 
         if self.confused:
-            mod = Loc(*choice(list(input_handlers.dir_keys.values())))
+            mod = Loc(*self.engine.rng.ai.choice(list(input_handlers.dir_keys.values())))
             a = BumpAction(mod)
             a.init(self.engine, self)
             self.confused -= 1
@@ -239,10 +258,10 @@ class Hostile(Living):
                 return
 
         if self.spells:
-            if self.fighter.hp<self.fighter.max_hp and HealSelf in self.spells and random()>.6:
+            if self.fighter.hp<self.fighter.max_hp and HealSelf in self.spells and self.engine.rng.ai.random()>.6:
                 HealSelf(self).activate()
                 return
-            if HasteSelf in self.spells and not self.haste_spell and random()>.35:
+            if HasteSelf in self.spells and not self.haste_spell and self.engine.rng.ai.random()>.35:
                 HasteSelf(self).activate()
                 return
 
@@ -267,11 +286,12 @@ class Hostile(Living):
 
     def attack_path(self, target):
         if self.game_map.visible[self.loc.x, self.loc.y]:
-            path = self.get_path_to(target.loc)
-            loc = path.pop(0)
-            a = MovementAction(self.loc.dir_to(loc))
-            a.init(self.engine, self)
-            return a
+            # all monsters share one distance field rooted at the target, see `GameMap.distance_field`
+            loc = self.game_map.step_towards(self.loc, target.loc)
+            if loc:
+                a = MovementAction(self.loc.dir_to(loc))
+                a.init(self.engine, self)
+                return a
 
 class HealingItem(Item):
     def activate(self):
@@ -335,12 +355,13 @@ class Mimic(Hostile):
     color = 63, 107, 163
     speed = 0.66
     fighter = 25,4,4
+    wanders = False
     revealed = False
     _char = _color = None
 
     def __str__(self):
         if not self._char or not self._color:
-            self._char, self._color = choice(list(special_data.items.values()))
+            self._char, self._color = self.engine.rng.world.choice(list(special_data.items.values()))
         return self.char if self.revealed else self._char
 
 class Leprechaun(Hostile):
@@ -351,7 +372,7 @@ class Leprechaun(Hostile):
 
     def special_attack(self, target):
         if target.gold:
-            g = min(target.gold, randint(5,150))
+            g = min(target.gold, self.engine.rng.combat.randint(5,150))
             self.gold += g
             target.gold -= g
             self.engine.messages.add(f"{self} brushes his hand over {target}'s pocket")
@@ -373,7 +394,7 @@ class Gremlin(Hostile):
 
     def pre_move(self):
         m = self.engine.game_map
-        if m.entity(self.loc, Water) and self.fighter._hp>1 and random()>.5:
+        if m.entity(self.loc, Water) and self.fighter._hp>1 and self.engine.rng.ai.random()>.5:
             lst = m.empty_adj(self.loc)
             if lst:
                 from procgen import spawn
@@ -408,9 +429,9 @@ class Chicatrice(Hostile):
 
     def on_attack(self, entity):
         e = entity
-        if random()<.33:
+        if self.engine.rng.combat.random()<.33:
             self.engine.messages.add(f'Chicatrice hisses at {e}')
-            if random()>.9:
+            if self.engine.rng.combat.random()>.9:
                 e.turning_to_stone = 5
 
 class Pyrolisk(Hostile):
@@ -421,7 +442,7 @@ class Pyrolisk(Hostile):
     def on_attack(self, entity):
         e = entity
         if not self.blinded and not e.blinded:
-            e.take_damage(randint(5,10))
+            e.take_damage(self.engine.rng.combat.randint(5,10))
 
 class Troll(Hostile):
     char = 'T'
@@ -444,7 +465,7 @@ class AuspiciousRoomScroll(Item):
     base_price = 30
 
     def activate(self):
-        r = choice(self.engine.game_map.rooms)
+        r = self.engine.rng.world.choice(self.engine.game_map.rooms)
         r.auspicious = 30
         self.container.remove(self)
         self.engine.messages.add('You feel like there is a good place for you somewhere on this level of caves')
@@ -504,7 +525,7 @@ class LightningScroll(Scroll):
         closest_distance = self.maximum_range + 1.0
         e = self.container.entity
 
-        for being in self.engine.game_map.living():
+        for being in self.engine.game_map.entities.within(e.loc, self.maximum_range, alive=True):
             if e.hostile_to(being):
                 l = being.loc
                 if being is not e and e.game_map.visible[l.x, l.y]:
@@ -645,11 +666,10 @@ class FireballScroll(Scroll):
             raise Impossible('You cannot target an area that you cannot see.')
 
         targets_hit = False
-        for being in self.game_map.living():
-            if being.loc.dist(Loc(*target_xy)) <= self.radius:
-                self.engine.messages.add( f'The {being} is engulfed in a fiery explosion, taking {self.damage} damage!')
-                being.take_damage(self.damage)
-                targets_hit = True
+        for being in self.game_map.entities.within(Loc(*target_xy), self.radius, alive=True):
+            self.engine.messages.add( f'The {being} is engulfed in a fiery explosion, taking {self.damage} damage!')
+            being.take_damage(self.damage)
+            targets_hit = True
 
         if not targets_hit:
             raise Impossible('There are no targets in the radius.')
@@ -698,7 +718,7 @@ class Box(Item):
 
     def __init__(self, engine, *a, **kw):
         self.inventory = Inventory(engine, self, 20)
-        self.locked = random()>.05
+        self.locked = engine.rng.spawn.random()>.05
         super().__init__(engine, *a, **kw)
 
 class RingOfFreeAction(Ring):
@@ -1034,9 +1054,9 @@ class Door(Entity):
     closed = True
     color = 205, 25, 205
 
-    def __init__(self, *a, **kw):
-        self.locked = random()>.95
-        super().__init__(*a, **kw)
+    def __init__(self, engine, *a, **kw):
+        self.locked = engine.rng.spawn.random()>.95
+        super().__init__(engine, *a, **kw)
 
     @property
     def char(self):
@@ -1049,6 +1069,7 @@ class Door(Entity):
     def toggle(self):
         if not self.locked:
             self.closed = not self.closed
+            self.blocking_changed()
 
 class Key(Tool):
     color = 205, 100, 205
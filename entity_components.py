@@ -1,4 +1,3 @@
-from random import random
 
 class Equipment:
     entity = ring1 = ring2 = None
@@ -226,10 +225,12 @@ class Fighter:
         e.char = '%'
         e.color = (191, 0, 0)
         e.blocking = False
+        e.blocking_changed()
         e.is_hostile = False
         e.is_alive = False
         e.name = f'remains of {self.entity.name}'
         e.render_order = 1
+        e.render_order_changed()
         for i in e.inventory:
             i.loc = e.loc
             eng.game_map.entities.add(i)
@@ -282,6 +283,6 @@ class Inventory:
         from entity import DamageType, Potion, Ring, Wand
         if type == DamageType.cold:
             for p in self.get_list(Potion):
-                if random()>.9:
+                if self.entity.engine.rng.combat.random()>.9:
                     self.entity.engine.add(f'Blast of cold breaks {p}')
                     self.remove(p)
@@ -1,7 +1,15 @@
-from random import randint
+import os
+import math
+import heapq
+import itertools
 import textwrap
+import tempfile
+from collections import deque
+from contextlib import contextmanager
 import numpy as np  # type: ignore
+from numpy.lib import recfunctions as rfn  # type: ignore
 import json
+import tcod
 
 import tile_types
 from util import Loc
@@ -46,11 +54,341 @@ class Stairs:
     def __repr__(self):
         return f'<{self.game_map}, {self.loc}>'
 
-class NumpyEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, np.ndarray):
-            return obj.tolist()
-        return super().default(obj)
+class EntitySet(set):
+    """Set of entities indexed by location, and, when `shape` of the map is given, a `blocked` array with the number of
+    blocking entities on each tile.
+
+    Entities are also kept in buckets by `render_order`, for drawing them without sorting, and entities that act on
+    their own (with a `speed`, other than the player) in a heap by `next_turn`, so that only the ones that are due are
+    woken up; active status effects (see `status_effects`) are kept in another heap by the time of their next tick or
+    expiry. The location and `is_alive` of every entity are also copied to a row of the `columns` array, for
+    vectorized distance queries.
+
+    Entities are iterated in the order they were added, as are the buckets, so that a game replays the same way for the
+    same seed (the order of a set follows the ids of the objects).
+
+    Each entity keeps a reference to the sets it belongs to, so that assigning `Entity.loc` can move it to the new
+    bucket; `Entity.blocking_changed()` and `Entity.render_order_changed()` have to be called when an entity starts or
+    stops blocking, or changes its render order or `is_alive`.
+    """
+    columns_dt = np.dtype([('x', np.int32), ('y', np.int32), ('on_map', bool), ('alive', bool)])
+
+    def __init__(self, entities=(), shape=None):
+        super().__init__()
+        self.shape = shape
+        self._by_loc = None
+        self._order = {}    # entity => None, in the order they were added
+        self.update(entities)
+
+    def __reduce__(self):
+        # entities may not be fully unpickled yet when the set is restored, so the index is rebuilt lazily
+        return self.__class__, (), (list(self), self.shape)
+
+    def __setstate__(self, state):
+        entities, self.shape = state
+        set.update(self, entities)
+        self._order = dict.fromkeys(entities)
+        self._by_loc = None
+
+    def __iter__(self):
+        return iter(self._order)
+
+    def copy(self):
+        return set(self)
+
+    def drop_index(self):
+        """Free the indexes; they are rebuilt when needed."""
+        shape, order = self.shape, self._order
+        vars(self).clear()
+        self.shape, self._order, self._by_loc = shape, order, None
+
+    def reset(self, entities):
+        """Replace the entities of the set with `entities` without `add()` and `remove()`, i.e. without updating their
+        references to the set, and drop the indexes."""
+        entities = list(entities)
+        set.clear(self)
+        set.update(self, entities)
+        self._order = dict.fromkeys(entities)
+        self.drop_index()
+
+    def add(self, e):
+        if e in self:
+            return
+        super().add(e)
+        self._order[e] = None
+        e._entity_sets += (self,)
+        if e.next_turn is None and e.speed and not e.is_player:
+            # a new entity starts with no energy, also when it's added in the middle of the enemies' turns
+            e.next_turn = e.engine.time + 1/e.speed
+        self._index(e, e.loc)
+        self.update_blocking(e)
+        self.update_render_order(e)
+        self.schedule(e)
+        for name in e.statuses:
+            self.schedule_status(e, name)
+
+    def update(self, entities):
+        for e in entities:
+            self.add(e)
+
+    def remove(self, e):
+        super().remove(e)
+        del self._order[e]
+        e._entity_sets = tuple(s for s in e._entity_sets if s is not self)
+        self._unindex(e, e.loc)
+        self.update_blocking(e)
+        self.update_render_order(e)
+        if self._by_loc is not None:
+            self._queued.pop(e, None)
+            for name in e.statuses:
+                self._queued.pop((e, name), None)
+
+    def discard(self, e):
+        if e in self:
+            self.remove(e)
+
+    def reindex(self):
+        self._by_loc = {}
+        self._blocking_at = {}
+        self._blocked = np.zeros(self.shape, dtype=np.uint8, order="F") if self.shape else None
+        self._by_render_order = {}
+        self._render_order_of = {}
+        # heaps of (time, seq, key), for turns keyed by the entity and for status timers by (entity, status name)
+        self._turns = []
+        self._timers = []
+        self._queued = {}       # key => seq of its entry; other entries of the key are stale
+        self._seq = itertools.count()
+        self.columns = np.zeros(max(64, len(self)), dtype=self.columns_dt)
+        self._rows = {}         # entity => its row in `columns`
+        self._row_entity = []   # row => entity, None for a free row
+        self._free_rows = []
+        for e in self:
+            self._index(e, e.loc)
+            self.update_blocking(e)
+            self.update_render_order(e)
+            self.schedule(e)
+            for name in e.statuses:
+                self.schedule_status(e, name)
+
+    def _index(self, e, loc):
+        if loc is not None and self._by_loc is not None:
+            self._by_loc.setdefault((loc.x, loc.y), {})[e] = None
+
+    def _unindex(self, e, loc):
+        if loc is None or self._by_loc is None:
+            return
+        key = loc.x, loc.y
+        bucket = self._by_loc.get(key)
+        if bucket:
+            bucket.pop(e, None)
+            if not bucket:
+                del self._by_loc[key]
+
+    def update_blocking(self, e):
+        """Move `e` in the `blocked` array to its current location, or take it out if it's no longer blocking."""
+        if self._by_loc is None or self._blocked is None:
+            return
+        old = self._blocking_at.pop(e, None)
+        if old:
+            self._blocked[old] -= 1
+        loc = e.loc
+        if e in self and e.blocking and loc is not None:
+            key = self._blocking_at[e] = loc.x, loc.y
+            self._blocked[key] += 1
+
+    def update_render_order(self, e):
+        """Move `e` to the bucket of its current `render_order`, or take it out if it's no longer in the set."""
+        if self._by_loc is None:
+            return
+        old = self._render_order_of.pop(e, None)
+        if old is not None:
+            bucket = self._by_render_order[old]
+            del bucket[e]
+            if not bucket:
+                del self._by_render_order[old]
+        if e in self:
+            order = self._render_order_of[e] = e.render_order
+            self._by_render_order.setdefault(order, {})[e] = None
+        self.update_row(e)
+
+    def update_row(self, e):
+        """Copy the location and `is_alive` of `e` to its row of `columns`, or free the row if it's no longer in the
+        set."""
+        row = self._rows.get(e)
+        if e not in self:
+            if row is not None:
+                del self._rows[e]
+                self._row_entity[row] = None
+                self.columns[row] = 0
+                self._free_rows.append(row)
+            return
+        if row is None:
+            if self._free_rows:
+                row = self._free_rows.pop()
+            else:
+                row = len(self._row_entity)
+                self._row_entity.append(None)
+                if row == len(self.columns):
+                    self.columns = np.concatenate([self.columns, np.zeros_like(self.columns)])
+            self._rows[e] = row
+            self._row_entity[row] = e
+        loc = e.loc
+        self.columns[row] = (0, 0, False, False) if loc is None else (loc.x, loc.y, True, e.is_alive)
+
+    def schedule(self, e):
+        """Queue `e` for its turn at `e.next_turn` (None for as soon as possible), replacing its previous entry."""
+        if self._by_loc is None or not e.speed or not e.is_alive or e.is_player or e not in self:
+            return
+        self._push(self._turns, e, -math.inf if e.next_turn is None else e.next_turn)
+
+    def schedule_status(self, e, name):
+        """Set the timer of status `name` of `e` to its next tick or expiry, or remove it if the status isn't active."""
+        if self._by_loc is None or e not in self:
+            return
+        t = getattr(type(e), name).next_event(e)
+        if t is None:
+            self._queued.pop((e, name), None)
+        else:
+            self._push(self._timers, (e, name), t)
+
+    def _push(self, heap, key, t):
+        seq = self._queued[key] = next(self._seq)
+        heapq.heappush(heap, (t, seq, key))
+
+    def _pop(self, heap, now):
+        while heap and heap[0][0] <= now:
+            _, seq, key = heapq.heappop(heap)
+            if self._queued.get(key) == seq:
+                del self._queued[key]
+                return key
+
+    def due(self, now):
+        """Take the first entity whose turn is at `now` or before out of the queue and return it, or None if there
+        isn't one."""
+        if self._by_loc is None:
+            self.reindex()
+        return self._pop(self._turns, now)
+
+    def due_status(self, now):
+        """Take the first status timer that is due at `now` out of the heap and return its (entity, status name), or
+        None if there isn't one."""
+        if self._by_loc is None:
+            self.reindex()
+        return self._pop(self._timers, now)
+
+    def moved(self, e, old_loc):
+        """Called by `Entity.loc` setter."""
+        self._unindex(e, old_loc)
+        self._index(e, e.loc)
+        self.update_blocking(e)
+        if self._by_loc is not None:
+            self.update_row(e)
+
+    def at(self, loc):
+        """Entities at `loc` (a Loc or an (x,y) tuple)."""
+        if self._by_loc is None:
+            self.reindex()
+        return self._by_loc.get(loc, ())
+
+    def within(self, loc, dist, alive=False, min_dist=0):
+        """Entities at `min_dist` to `dist` from `loc` (Chebyshev distance, as `Loc.dist()`), only living ones if
+        `alive` is set."""
+        if self._by_loc is None:
+            self.reindex()
+        n = len(self._row_entity)
+        c = self.columns[:n]
+        d = np.maximum(np.abs(c['x'] - loc.x), np.abs(c['y'] - loc.y))
+        near = c['on_map'] & (d <= dist)
+        if min_dist:
+            near &= d >= min_dist
+        if alive:
+            near &= c['alive']
+        ents = self._row_entity
+        return [ents[i] for i in np.flatnonzero(near).tolist()]
+
+    def by_render_order(self):
+        """Entities in the order they are drawn."""
+        if self._by_loc is None:
+            self.reindex()
+        for order in sorted(self._by_render_order):
+            yield from self._by_render_order[order]
+
+    @property
+    def blocked(self):
+        if self._by_loc is None:
+            self.reindex()
+        return self._blocked
+
+
+def save_custom_maps(filename, maps):
+    """Write `maps` dict as a compressed .npz: map names, plus a header and the tiles array for each map."""
+    arrays = dict(names=np.array(list(maps), dtype=str))
+    for n, m in enumerate(maps.values()):
+        arrays[f'header{n}'] = m.header()
+        arrays[f'tiles{n}'] = m.tiles
+    with open(filename, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+
+def load_custom_maps(filename):
+    with np.load(filename) as data:
+        return {name: GameMap.load(data[f'header{n}'], data[f'tiles{n}']) for n, name in enumerate(data['names'].tolist())}
+
+def load_json_custom_maps(filename):
+    with open(filename) as f:
+        return {name: GameMap.load_json(jdata) for name, jdata in json.loads(f.read()).items()}
+
+
+def copy_rgb(dst, src):
+    """`dst[:] = src` for console.rgb arrays, copied as raw records: assigning the padded structured dtype field by field
+    is an order of magnitude slower."""
+    void = np.dtype((np.void, src.itemsize))
+    dst.view(void)[:] = src.view(void)
+
+
+class RenderCache:
+    """What `GameMap.render` drew last, so that only the parts that changed are recomputed; kept on the Engine, but not
+    saved."""
+    def __init__(self):
+        self.game_map = None
+        self.tiles_version = None
+        self.layer = self.visible = self.explored = None    # map tiles as drawn, and the state they were drawn for
+        self.messages_key = self.messages_rgb = None
+
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def map_layer(self, m, dtype):
+        """Tiles of `m` as they should be drawn, recomputed only where visibility or the tiles changed."""
+        if self.game_map is not m or self.tiles_version != m.tiles_version or self.layer.dtype != dtype:
+            self.game_map = m
+            self.tiles_version = m.tiles_version
+            self.layer = np.empty((m.width, m.height), dtype=dtype, order='F')
+            self.visible, self.explored = m.visible.copy(), m.explored.copy()
+            changed = slice(None)
+        else:
+            changed = (m.visible != self.visible) | (m.explored != self.explored)
+            if not changed.any():
+                return self.layer
+            self.visible[:], self.explored[:] = m.visible, m.explored
+        tiles = m.tiles[changed]
+        self.layer[changed] = np.select(condlist=[m.visible[changed], m.explored[changed]],
+                                        choicelist=[tiles['light'], tiles['dark']], default=tile_types.SHROUD)
+        return self.layer
+
+    def render_messages(self, console, messages, x, y, width, height):
+        """Render the message log panel, or copy it from the last time it was rendered if there are no new
+        messages."""
+        key = id(messages), messages.version, width, height
+        region = slice(x, x+width), slice(y, y+height)
+        if key != self.messages_key:
+            messages.render(console, x, y, width, height)
+            self.messages_key, self.messages_rgb = key, console.rgb[region].copy()
+        else:
+            copy_rgb(console.rgb[region], self.messages_rgb)
+
 
 class GameMap:
     up = None
@@ -61,32 +399,76 @@ class GameMap:
     hidden_rooms = None
     reveal = False
     cursor = None
+    distance_fields = None  # root => distance array, reset on every enemy turn
+    tiles_version = 0       # incremented by `tiles_changed()`; cached renders and fields of view depend on it
+    left_at = None          # `Engine.time` when the player left the level
+    max_wander = 20         # steps a monster wanders at most while the player is away
+    compacted = None        # (tile types, tile type indices, packed explored) while the arrays are compacted
 
     def __init__(self, width, height, entities, level):
         self.level = level
-        self.entities = entities
         self.width, self.height = width, height
+        self.entities = EntitySet(entities, (width, height))
         self.tiles = np.full((width, height), fill_value=tile_types.wall, order="F")
         self.visible = np.full((width, height), fill_value=False, order="F")
         self.explored = np.full((width, height), fill_value=False, order="F")
 
-    def serialize(self):
-        up, left, right = self.up, self.left, self.right
-        up = tuple(up.loc) if up else None
-        left = tuple(left.loc) if left else None
-        right = tuple(right.loc) if right else None
-        d = dict(width=self.width, height=self.height, tiles=self.tiles, up=up, left=left, right=right)
-        return json.dumps(d, cls=NumpyEncoder)
+    def tiles_changed(self):
+        """Call after changing `tiles` of a map that may have been rendered."""
+        self.tiles_version += 1
+
+    def compact(self):
+        """Replace the arrays of a level the player is away from by a smaller form: `tiles` by indices into the
+        distinct tile types, `explored` bit-packed, `visible` dropped. `expand()` restores them."""
+        if self.compacted:
+            return
+        void = np.dtype((np.void, self.tiles.itemsize))
+        types, index = np.unique(np.ascontiguousarray(self.tiles).reshape(-1).view(void), return_inverse=True)
+        index = index.astype(np.uint8 if len(types) <= 256 else np.uint16).reshape(self.tiles.shape)
+        self.compacted = types.view(self.tiles.dtype), index, np.packbits(self.explored)
+        del self.tiles, self.visible, self.explored
+        self.distance_fields = None
+
+    def expand(self):
+        if not self.compacted:
+            return
+        types, index, explored = self.compacted
+        shape = self.width, self.height
+        self.tiles = np.asfortranarray(types[index])
+        self.explored = np.asfortranarray(np.unpackbits(explored, count=index.size).reshape(shape).astype(bool))
+        self.visible = np.full(shape, fill_value=False, order="F")
+        self.compacted = None
+
+    def header(self):
+        """Dimensions and stairs locations (-1 when missing) for the binary custom maps file."""
+        h = [self.width, self.height]
+        for st in (self.up, self.left, self.right):
+            h.extend(st.loc if st else (-1, -1))
+        return np.array(h, dtype=np.int32)
 
     @staticmethod
-    def load(data):
+    def load(header, tiles):
+        width, height, *stairs = header.tolist()
+        m = GameMap(width, height, (), 1)
+        m.tiles[:] = tiles
+        up, left, right = (stairs[n:n+2] for n in (0, 2, 4))
+        if up[0] >= 0:
+            m.up = Stairs(Loc(*up))
+        if left[0] >= 0:
+            m.left = Stairs(Loc(*left), down_dir='left')
+        if right[0] >= 0:
+            m.right = Stairs(Loc(*right), down_dir='right')
+        return m
+
+    @staticmethod
+    def load_json(data):
+        """Load a map from the old JSON custom maps format."""
         d = data = json.loads(data)
-        m = GameMap(d['width'], d['height'], set(), 1)
-        rows = d['tiles']
-        for p,r in enumerate(rows):
-            for q,col in enumerate(r):
-                a,b,c,d=col
-                m.tiles[p,q] = np.array((a,b,tuple(c),tuple(d)), dtype=tile_types.tile_dt)
+        m = GameMap(d['width'], d['height'], (), 1)
+        # flatten each cell to 16 numbers and convert the whole grid at once
+        cells = [[a, b, dk[0], *dk[1], *dk[2], lt[0], *lt[1], *lt[2]] for row in d['tiles'] for a,b,dk,lt in row]
+        tiles = rfn.unstructured_to_structured(np.array(cells), dtype=tile_types.tile_dt)
+        m.tiles[:] = tiles.reshape(m.width, m.height)
 
         up, left, right = data['up'], data['left'], data['right']
         if up:
@@ -97,9 +479,41 @@ class GameMap:
             m.right = Stairs(Loc(*right), down_dir='right')
         return m
 
-    def make_turn(self):
+    def make_turn(self, turns=1):
         for r in self.rooms:
-            r.auspicious = max(0, r.auspicious-1)
+            r.auspicious = max(0, r.auspicious-turns)
+
+    def update_statuses(self, engine):
+        """Tick status effects of the entities and end the ones that have run out."""
+        while True:
+            timer = self.entities.due_status(engine.time)
+            if not timer:
+                break
+            e, name = timer
+            getattr(type(e), name).update(e, engine)
+
+    def catch_up(self, engine):
+        """When the player comes back to the level, make up for the turns since they left with a cheap simulation:
+        status effects run out, living entities regenerate and awake monsters wander off. Nothing is logged."""
+        if self.left_at is None:
+            return
+        turns = engine.time - self.left_at
+        self.left_at = None
+        if turns <= 0:
+            return
+        self.make_turn(turns)
+        rnd = engine.rng.ai
+        with engine.messages.muted():
+            self.update_statuses(engine)
+            for e in list(self.entities.by_render_order()):
+                if not e.is_alive or e.is_player:
+                    continue
+                e.fighter.heal(turns)
+                if e.wanders and e.is_hostile and e.asleep==0 and e.paralized==0:
+                    for _ in range(min(int(turns * e.speed), self.max_wander)):
+                        locs = self.empty_adj(e.loc)
+                        if locs:
+                            e.loc = rnd.choice(sorted(locs))
 
     def auspicious_rooms(self):
         return [r for r in self.rooms if r.auspicious]
@@ -117,17 +531,16 @@ class GameMap:
         if not self.in_bounds(loc) or not self.visible[loc.x, loc.y]:
            return ''
 
-        names = ', '.join( e.name for e in self.entities if e.loc==loc)
+        names = ', '.join( e.name for e in self.entities.at(loc))
         names = names.capitalize()
         console.print(x=r_loc.x, y=r_loc.y, string=names)
 
     def entities_within_dist(self, ent_or_loc, dist):
         loc = getattr(ent_or_loc, 'loc', ent_or_loc)
-        lst = [e for e in self.entities if e.loc.dist(loc)<=dist and e.loc!=loc]
-        return lst
+        return self.entities.within(loc, dist, min_dist=1)
 
     def names_at_loc(self, loc, exclude=()):
-        lst = [e for e in self.entities if e.loc==loc and e not in exclude]
+        lst = [e for e in self.entities.at(loc) if e not in exclude]
 
         rm = set()
         for o in exclude:
@@ -137,7 +550,7 @@ class GameMap:
                        rm.add(e)
         lst = [e for e in lst if e not in rm]
 
-        names = ', '.join( e.name for e in lst if e.loc==loc and e not in exclude)
+        names = ', '.join( e.name for e in lst)
         return names.capitalize()
 
     def place(self, item, loc=None):
@@ -145,30 +558,33 @@ class GameMap:
         if loc:
             item.loc = loc
 
+    @property
+    def blocked(self):
+        """Number of blocking entities on each tile."""
+        return self.entities.blocked
+
     def get_blocking_entity_at_loc(self, loc):
-        for entity in self.entities:
-            if entity.blocking and entity.loc==loc:
+        for entity in self.entities.at(loc):
+            if entity.blocking:
                 return entity
 
     def get_entities_at_loc(self, loc):
-        return [e for e in self.entities if e.loc==loc]
+        return list(self.entities.at(loc))
 
     def get_living_at_locs(self, locs):
-        locs = set(locs)
         l = []
-        for entity in self.entities:
-            if entity.is_alive and entity.loc in locs:
-                l.append(entity)
+        for loc in set(locs):
+            l.extend(e for e in self.entities.at(loc) if e.is_alive)
         return l
 
     def get_all_living_at_loc(self, loc):
-        for entity in self.entities:
-            if entity.is_alive and entity.loc==loc:
+        for entity in list(self.entities.at(loc)):
+            if entity.is_alive:
                 yield entity
 
     def get_living_at_loc(self, loc):
-        for entity in self.entities:
-            if entity.is_alive and entity.loc==loc:
+        for entity in self.entities.at(loc):
+            if entity.is_alive:
                 return entity
 
     def living(self):
@@ -179,24 +595,51 @@ class GameMap:
         yield from (e for e in self.entities if isinstance(e, Item) and isinstance(e, filter))
 
     def item(self, loc, filter=object):
-        it = self.items(filter)
-        # for i in it:
-            # print("i.loc", i.loc)
-        l = [i for i in it if i.loc==loc]
-        if l:
-            return l[0]
+        from entity import Item
+        for e in self.entities.at(loc):
+            if isinstance(e, Item) and isinstance(e, filter):
+                return e
 
     def entity(self, loc, filter=object):
-        l = [e for e in self.entities if isinstance(e, filter) and e.loc==loc]
-        if l:
-            return l[0]
+        for e in self.entities.at(loc):
+            if isinstance(e, filter):
+                return e
+
+    def path_cost(self):
+        """Cost of entering each tile for pathfinding: 0 for walls, 1 for walkable tiles plus 10 for blocked tiles."""
+        cost = np.array(self.tiles["walkable"], dtype=np.int8)
+        # Add to the cost of a blocked position.  A lower number means more enemies will crowd behind each other
+        # in hallways.  A higher number means enemies will take longer paths in order to surround the player.
+        cost[(self.blocked > 0) & (cost > 0)] += 10
+        return cost
+
+    def distance_field(self, root):
+        """Dijkstra distance from `root` to every tile; computed once per enemy turn for each root."""
+        if self.distance_fields is None:
+            self.distance_fields = {}
+        key = root.x, root.y
+        if key not in self.distance_fields:
+            dist = tcod.path.maxarray((self.width, self.height), dtype=np.int32, order="F")
+            dist[key] = 0
+            self.distance_fields[key] = tcod.path.dijkstra2d(dist, self.path_cost(), 2, 3, out=dist)
+        return self.distance_fields[key]
+
+    def step_towards(self, loc, target):
+        """Unblocked neighbour of `loc` that is closest to `target`, if it's closer than `loc` itself."""
+        dist = self.distance_field(target)
+        best = None
+        best_dist = dist[loc.x, loc.y]
+        for n in loc.adj_locs():
+            if self.in_bounds(n) and dist[n.x, n.y] < best_dist and not self.blocked[n.x, n.y]:
+                best, best_dist = n, dist[n.x, n.y]
+        return best
 
     def in_bounds(self, loc):
         """Return True if x and y are inside of the bounds of this map."""
         return 0 <= loc.x < self.width and 0 <= loc.y < self.height
 
-    def random(self):
-        return Loc(randint(0, self.width), randint(0, self.height))
+    def random(self, rnd):
+        return Loc(rnd.randint(0, self.width), rnd.randint(0, self.height))
 
     def empty_lst(self, locs):
         return [l for l in locs if self.empty(l)]
@@ -207,9 +650,9 @@ class GameMap:
     def walkable(self, loc):
         return self.tiles['walkable'][loc.x, loc.y]
 
-    def random_empty(self):
+    def random_empty(self, rnd):
         for _ in range(100):
-            l = self.random()
+            l = self.random(rnd)
             if self.empty(l):
                 return l
 
@@ -218,7 +661,7 @@ class GameMap:
             return False
         if not self.tiles['walkable'][loc.x, loc.y]:
             return False
-        if self.get_blocking_entity_at_loc(loc):
+        if self.blocked[loc.x, loc.y]:
             return False
         return True
 
@@ -232,24 +675,31 @@ class GameMap:
     def render(self, engine, console):
         if self.reveal:
             self.visible = np.full((self.width, self.height), fill_value=True, order='F')
-        console.rgb[0:self.width, 0:self.height] = np.select(
-            condlist=[self.visible, self.explored],
-            choicelist=[self.tiles['light'], self.tiles['dark']],
-            default=tile_types.SHROUD
-        )
-
-        player = engine.player
-        for entity in sorted(self.entities, key=lambda x: x.render_order):
-            loc = entity.loc
-            if self.visible[loc.x, loc.y] and not player.blinded:
-                console.print(x=loc.x, y=loc.y, string=str(entity), fg=entity.color)
+        rgb = console.rgb
+        copy_rgb(rgb[0:self.width, 0:self.height], engine.render_cache.map_layer(self, rgb.dtype))
+
+        if not engine.player.blinded:
+            # one character per entity, written to the console in bulk; later entities in the render order win
+            cells = {}
+            visible = self.visible
+            for entity in self.entities.by_render_order():
+                loc = entity.loc
+                if visible[loc.x, loc.y]:
+                    ch = str(entity)
+                    if ch:
+                        cells[loc.x, loc.y] = ord(ch), entity.color
+            if cells:
+                xs, ys = zip(*cells)
+                chars, colors = zip(*cells.values())
+                rgb['ch'][xs, ys] = chars
+                rgb['fg'][xs, ys] = colors
 
         f = engine.player.fighter
         console.print(x=0, y=45, string=f'[{engine.level+1:-2}]', fg=Color.white)
         console.print(x=5, y=45, string=f'${engine.player.gold}', fg=Color.yellow)
         self.render_bar(console, f.hp, f.max_hp, 20)
         self.render_names_at_location(console, engine.mouse_loc, Loc(21,44))
-        engine.messages.render(console, 21, 45, 40, 5)
+        engine.render_cache.render_messages(console, engine.messages, 21, 45, 40, 5)
         console.print( x=1, y=47, string=f'{engine.player.loc}')
         self.render_vertical_view(engine, console)
 
@@ -283,9 +733,8 @@ class GameMap:
             for y in (37,36,35,34):
                 console.print(x+2, y, '=', fg=Color.white)
 
-        for e in self.entities:
-            if e.loc==loc:
-                console.print(x+2, 38-e.vloc, e.vchar or e.char, fg=Color.white)
+        for e in self.entities.at(loc):
+            console.print(x+2, 38-e.vloc, e.vchar or e.char, fg=Color.white)
 
 
     def find_walkable(self, loc, dir):
@@ -315,11 +764,18 @@ class GameMap:
 
 
 class Message:
+    _wrapped = None     # (width, count), lines of `full_text` wrapped to width
+
     def __init__(self, text, fg):
         self.plain_text = text
         self.fg = fg
         self.count = 1
 
+    def __getstate__(self):
+        state = vars(self).copy()
+        state.pop('_wrapped', None)
+        return state
+
     @property
     def full_text(self):
         """The full text of this message, including the count if necessary."""
@@ -327,36 +783,80 @@ class Message:
             return f"{self.plain_text} (x{self.count})"
         return self.plain_text
 
+    def lines(self, width):
+        """`full_text` wrapped to `width`; cached until the width or the count changes."""
+        key = width, self.count
+        if not self._wrapped or self._wrapped[0] != key:
+            self._wrapped = key, [l for line in self.full_text.splitlines()
+                                  for l in textwrap.wrap(line, width, expand_tabs=True)]
+        return self._wrapped[1]
+
 
 class MessageLog:
+    """The last `size` messages; older ones are spilled to a temporary file, which is only read back for the message
+    history and is not saved."""
+    size = 500
+
     def __init__(self):
-        self.messages = []
+        self.messages = deque(maxlen=self.size)
+        self.version = 0    # incremented whenever a message is added or stacked
+        self.spill = None
+        self.mute = False
+
+    def __getstate__(self):
+        return dict(vars(self), spill=None)
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.messages.extend(state['messages'])
+        self.version = state.get('version', 0)
+
+    @contextmanager
+    def muted(self):
+        """Drop the messages added in the `with` block."""
+        self.mute = True
+        try:
+            yield
+        finally:
+            self.mute = False
 
     def add(self, text, fg=Color.white, stack=True, dedupe=False):
         """ If `stack` is True then the message can stack with a previous message of the same text
         `dedupe`=True - do not add if previous msg is the same as current
         """
-        if dedupe and self.messages and text == self.messages[-1].plain_text:
-            pass
+        if self.mute or dedupe and self.messages and text == self.messages[-1].plain_text:
+            return
         elif stack and self.messages and text == self.messages[-1].plain_text:
             self.messages[-1].count += 1
         else:
+            if len(self.messages) == self.messages.maxlen:
+                self.spill_message(self.messages[0])
             self.messages.append(Message(text, fg))
-
-    def wrap(self, string, width):
-        for line in string.splitlines():
-            yield from textwrap.wrap( line, width, expand_tabs=True)
+        self.version += 1
+
+    def spill_message(self, message):
+        if not self.spill:
+            self.spill = tempfile.TemporaryFile('w+', encoding='utf-8')
+        self.spill.write(json.dumps([message.full_text, message.fg]) + '\n')
+
+    def history(self):
+        """All messages of this session, including the spilled ones."""
+        old = []
+        if self.spill:
+            self.spill.seek(0)
+            old = [Message(text, tuple(fg)) for text, fg in map(json.loads, self.spill)]
+            self.spill.seek(0, os.SEEK_END)
+        return old + list(self.messages)
 
     def render(self, console, x, y, width, height, msgs=None):
         """ `x`, `y`, `width`, `height` is the rectangular region to render onto the `console`."""
-        msgs = msgs or self.messages
-        self.render_messages(console, x, y, width, height, self.messages)
+        self.render_messages(console, x, y, width, height, self.messages if msgs is None else msgs)
 
     def render_messages(self, console, x, y, width, height, messages):
         y_offset = height - 1
 
         for message in reversed(messages):
-            for line in reversed(list(self.wrap(message.full_text, width))):
+            for line in reversed(message.lines(width)):
                 console.print(x=x, y=y + y_offset, string=line, fg=message.fg)
                 y_offset -= 1
                 if y_offset < 0:
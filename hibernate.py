@@ -0,0 +1,112 @@
+"""Hibernation of the levels the player is away from.
+
+Levels more than `radius` stairs away from the current one in the level tree are compacted (see `GameMap.compact()`).
+When there are more than `resident` compacted levels, the least recently visited ones are spilled to lzma-compressed
+files in a temporary directory, with their rooms and entities; the `GameMap` and its `EntitySet` stay as empty shells
+that keep the stairs, so that references to the level remain valid. Special entities (with an `id`, e.g. quest givers,
+which quests refer to) stay in memory and are stored as references, like the engine, the player and the other levels.
+
+A spilled level is read back when the player takes the stairs to it, or when the game is saved and the level has
+changed since the last save.
+"""
+import os
+import lzma
+import tempfile
+from collections import OrderedDict
+
+import savegame
+
+
+class Hibernator:
+    """Kept on the Engine; not saved, so the levels of a loaded game are all in memory (compacted ones stay compacted)."""
+    radius = 2
+    resident = 16
+    spilled_attrs = 'compacted', 'rooms', 'hidden_rooms'
+
+    def __init__(self):
+        self.dir = None
+        self.near = None                # working set after the last update, None for all levels
+        self.compacted = OrderedDict()  # ids of compacted levels in memory, least recently left first
+        self.spilled = {}               # level id => file name, special entities
+
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def working_set(self, tree, lid):
+        """Ids of the levels at most `radius` stairs away from level `lid`."""
+        near, edge = {lid}, [lid]
+        for _ in range(self.radius):
+            edge = [n for e in edge for n in tree.neighbours(e) if n not in near]
+            near.update(edge)
+        return near
+
+    def update(self, engine):
+        """Call when the player has moved to another level: restore the current level and the ones around it, compact
+        the ones that are no longer around it and spill the least recently left compacted levels over `resident`."""
+        tree = engine.tree
+        near = self.working_set(tree, engine.cur_node)
+        for lid in near:
+            self.restore(engine, lid)
+            self.compacted.pop(lid, None)
+            tree.maps[lid].expand()
+        custom = {id(m) for m in engine.custom_maps.values()}
+        for lid in (tree if self.near is None else self.near):
+            m = tree.maps[lid]
+            if lid not in near and lid not in self.spilled and id(m) not in custom:
+                m.compact()
+                self.compacted[lid] = None
+        self.near = near
+        while len(self.compacted) > self.resident:
+            lid = next(iter(self.compacted))
+            del self.compacted[lid]
+            self.spill(engine, lid)
+
+    def refs(self, engine):
+        refs = {id(engine): ('engine',), id(engine.player): ('player',)}
+        for lid, m in enumerate(engine.tree.maps):
+            refs[id(m)] = 'map', lid
+            refs[id(m.entities)] = 'entities', lid
+        return refs
+
+    def spill(self, engine, lid):
+        m = engine.tree.maps[lid]
+        player = engine.player
+        entities = [e for e in m.entities if e is not player]
+        specials = [e for e in entities if e.id is not None]
+        refs = self.refs(engine)
+        refs.update((id(e), ('special', n)) for n, e in enumerate(specials))
+        if not self.dir:
+            self.dir = tempfile.TemporaryDirectory(prefix='levels-')
+        fn = os.path.join(self.dir.name, f'level-{lid}')
+        state = {k: m.__dict__.pop(k) for k in self.spilled_attrs if k in m.__dict__}
+        savegame.dump(fn, [(state, entities)], refs)
+
+        m.entities.reset([player] if player in m.entities else [])
+        saved = engine.journal.saved.get(lid)
+        if saved:
+            # only the entities that may be referenced from the engine are needed for the next save; entries are
+            # already None if the level was spilled before
+            engine.journal.saved[lid] = [e if e is not None and (e.id is not None or e is player) else None
+                                         for e in saved]
+        self.spilled[lid] = fn, specials
+
+    def restore(self, engine, lid):
+        """Read back level `lid` if it was spilled; it stays compacted."""
+        if lid not in self.spilled:
+            return
+        fn, specials = self.spilled.pop(lid)
+        objects = {('engine',): engine, ('player',): engine.player}
+        for l, m in enumerate(engine.tree.maps):
+            objects['map', l] = m
+            objects['entities', l] = m.entities
+        objects.update((('special', n), e) for n, e in enumerate(specials))
+        with lzma.open(fn, 'rb') as f:
+            state, entities = savegame.Unpickler(f, objects).load()
+        os.remove(fn)
+        m = engine.tree.maps[lid]
+        m.__dict__.update(state)
+        m.entities.reset(list(m.entities) + entities)
+        self.compacted[lid] = None
@@ -1,5 +1,4 @@
 from copy import deepcopy
-from random import random, randint
 from textwrap import wrap
 from itertools import compress
 import traceback
@@ -9,7 +8,7 @@ from tcod import libtcodpy
 import constants
 from actions import BumpAction, WaitAction, MovementAction, PickupAction, Impossible, DropItem
 from util import Loc
-from game_map import Color
+from game_map import Color, EntitySet
 import tile_types
 
 dir_keys_cardinal = dict(
@@ -54,7 +53,8 @@ class EventHandler(tcod.event.EventDispatch):
                     mod = Loc(*dir_keys[k])
                     if self.go:
                         mod = self.fast_go(mod)
-                    action = BumpAction(mod)
+                    if mod:
+                        action = BumpAction(mod)
 
         self.go = False
         import entity
@@ -62,7 +62,7 @@ class EventHandler(tcod.event.EventDispatch):
         if key == keys.ESCAPE:
             engine.context = None  # tcod context cannot be pickled
             engine.game_map.cursor = None   # EDITOR cursor
-            self.save_game('game.sav', 'custom_maps.dat')
+            self.save_game('game.sav', 'custom_maps.npz')
             raise SystemExit()
 
         player = self.player
@@ -94,6 +94,7 @@ class EventHandler(tcod.event.EventDispatch):
             for l in self.player.loc.adj():
                 if self.game_map.tiles[l] == tile_types.hidden_passage:
                     self.game_map.tiles[l] = tile_types.floor
+                    self.game_map.tiles_changed()
             else:
                 engine.messages.add('You do not find anything hidden.')
 
@@ -236,7 +237,7 @@ class EventHandler(tcod.event.EventDispatch):
         gm.entities = None
         gm = deepcopy(gm)
         # map.up.game_map = map.up.above_loc = None
-        gm.entities = set()
+        gm.entities = EntitySet((), gm.tiles.shape)
         self.engine.custom_maps[name] = gm
 
         # restore current map
@@ -258,7 +259,18 @@ class EventHandler(tcod.event.EventDispatch):
         if map and map.in_bounds(l):
             self.engine.mouse_loc = l
 
+    def visible_hostiles(self):
+        m = self.engine.game_map
+        return {e for e in m.entities if e.is_hostile and m.visible[e.loc.x, e.loc.y]}
+
     def fast_go(self, mod):
+        """Run in direction `mod`, following corridors, for up to 100 steps without rendering. Stop in an open area or
+        where a side passage branches off, and return the direction for the last step; return None if interrupted because a
+        monster came into view, a message was logged or the player lost HP."""
+        messages = self.engine.messages
+        log = messages.version
+        hp = self.player.fighter.hp
+        hostiles = self.visible_hostiles()
         for _ in range(100):
             a = MovementAction(mod)
             a.init(self.engine, self.player)
@@ -276,10 +288,14 @@ class EventHandler(tcod.event.EventDispatch):
             elif not ok or sum(locs_e)==2:
                 # open area, stop
                 break
+            elif sum(locs_e)==1 and self.game_map.empty(loc+mod):
+                # side passage, stop
+                break
 
             self.engine.handle_enemy_turns()
             self.engine.update_fov()
-            self.engine.render()
+            if messages.version != log or self.player.fighter.hp < hp or self.visible_hostiles() - hostiles:
+                return
         return mod
 
     def on_render(self, console):
@@ -302,8 +318,10 @@ class MapEditorHandler(EventHandler):
 
         if key==keys.w:
             self.game_map.tiles[c.x,c.y] = tile_types.wall
+            self.game_map.tiles_changed()
         elif key==keys.x:
             self.game_map.tiles[c.x,c.y] = tile_types.floor
+            self.game_map.tiles_changed()
         elif key==keys.e or key==keys.ESCAPE:
             self.game_map.cursor = None
             self.engine.event_handler = EventHandler(self.engine)
@@ -311,6 +329,7 @@ class MapEditorHandler(EventHandler):
             for x in range(80):
                 for y in range(45):
                     game_map.tiles[x,y] = tile_types.wall if Shift else tile_types.floor
+            game_map.tiles_changed()
         elif key==keys.r:
             self.engine.event_handler = TextInputHandler(self.engine, callback=self.make_room, prompt='enter width height > ')
         elif key==keys.l and Shift:
@@ -328,6 +347,7 @@ class MapEditorHandler(EventHandler):
         except Exception as e:
             print(e)
             self.engine.messages.add('wrong input..')
+        map.tiles_changed()
         self.engine.event_handler = MapEditorHandler(self.engine)
 
     def make_line(self, txt):
@@ -342,6 +362,7 @@ class MapEditorHandler(EventHandler):
         except Exception as e:
             print(e)
             self.engine.messages.add('wrong input..')
+        map.tiles_changed()
         self.engine.event_handler = MapEditorHandler(self.engine)
 
 CURSOR_Y_KEYS = {
@@ -354,7 +375,7 @@ CURSOR_Y_KEYS = {
 class MapViewer(EventHandler):
     def on_render(self, console):
         super().on_render(console)  # Draw the main state as the background.
-        lines = self.engine.show_tree()
+        lines, row = self.engine.tree.layout(self.engine.cur_node)
         con = tcod.console.Console(console.width - 6, console.height - 6)
         con.draw_frame(0, 0, con.width, con.height)
         con.print_box( 0, 0, con.width, 1, "┤MAP├", alignment=libtcodpy.CENTER)
@@ -362,16 +383,13 @@ class MapViewer(EventHandler):
         h = self.engine.game_map.height-1
 
         if len(lines)>h:
-            for n,l in enumerate(lines):
-                if '*' in l:
-                    break
-
-            st = max(0, n-h//2)
-            lines = lines[st:n+h//2]
+            st = max(0, row-h//2)
+            lines = lines[st:row+h//2]
+            row -= st
 
         for n, l in enumerate(lines):
             l = l[:self.engine.game_map.width-4]
-            if '*' in l:
+            if n == row and l.count('*') == 2:
                 a,b,c = l.split('*')
                 con.print(x=3, y=y+n, string=a + '*')
                 con.print(x=3 + len(a)+1, y=y+n, string=b, bg=Color.yellow, fg=Color.black)
@@ -386,7 +404,8 @@ class MapViewer(EventHandler):
 class HistoryViewer(EventHandler):
     def __init__(self, engine):
         super().__init__(engine)
-        self.log_length = len(engine.messages.messages)
+        self.history = engine.messages.history()
+        self.log_length = len(self.history)
         self.cursor = self.log_length - 1
 
     def on_render(self, console):
@@ -398,7 +417,7 @@ class HistoryViewer(EventHandler):
         log_console.print_box( 0, 0, log_console.width, 1, "┤Message history├", alignment=libtcodpy.CENTER)
 
         self.engine.messages.render( log_console, 1, 1, log_console.width - 2, log_console.height - 2,
-            self.engine.messages.messages[: self.cursor + 1])
+            self.history[: self.cursor + 1])
         log_console.blit(console, 3, 3)
 
     def ev_keydown(self, event):
@@ -752,15 +771,15 @@ class KickHandler(EventHandler):
                     if isinstance(ent, Door):
                         self.engine.messages.add('Door breaks')
                         self.engine.game_map.entities.remove(ent)
-                        if random()>.6:
-                            dmg = randint(6,25)
+                        if self.engine.rng.combat.random()>.6:
+                            dmg = self.engine.rng.combat.randint(6,25)
                             self.engine.player.fighter.take_damage(dmg)
 
                     elif isinstance(ent, Box) and ent.locked:
                         self.engine.messages.add('Box lock breaks')
                         ent.locked = False
-                        if random()>.6:
-                            dmg = randint(6,25)
+                        if self.engine.rng.combat.random()>.6:
+                            dmg = self.engine.rng.combat.randint(6,25)
 
                 if dmg:
                     self.engine.player.fighter.take_damage(dmg)
@@ -867,7 +886,7 @@ class MainMenu(EventHandler):
 
     def ev_keydown(self, event):
         from engine import load_game, new_game
-        custom_maps_fn = 'custom_maps.dat'
+        custom_maps_fn = 'custom_maps.npz'
         if event.sym in (tcod.event.KeySym.q, tcod.event.KeySym.ESCAPE):
             raise SystemExit()
         elif event.sym == tcod.event.KeySym.c:
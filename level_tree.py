@@ -0,0 +1,97 @@
+"""The levels of a game as a binary tree: every level has up stairs to its parent and up to two down stairs, `left` and
+`right`, to its children."""
+
+
+class LevelTree:
+    """Levels in lists indexed by level id, the top level being 0: id of the parent, ids of the levels below the left
+    and right down stairs, and the `GameMap`; None where there isn't one.
+
+    Down stairs to levels that haven't been generated yet are kept in `frontier`, and the layout drawn by the map viewer
+    is cached until the tree changes.
+    """
+    def __init__(self, game_map=None):
+        self.parent = [None]
+        self.left = [None]
+        self.right = [None]
+        self.maps = [None]
+        self.frontier = {}  # (level id, down_dir) => None, in the order they were found
+        self._lines = None
+        self._marked = None
+        if game_map:
+            self.set_map(0, game_map)
+
+    def __getstate__(self):
+        return dict(vars(self), _lines=None, _marked=None)
+
+    def __len__(self):
+        return len(self.maps)
+
+    def __iter__(self):
+        return iter(range(len(self.maps)))
+
+    def child(self, lid, down_dir):
+        return (self.left if down_dir == 'left' else self.right)[lid]
+
+    def neighbours(self, lid):
+        return [n for n in (self.parent[lid], self.left[lid], self.right[lid]) if n is not None]
+
+    def add(self, parent, down_dir, game_map):
+        """Add `game_map` as the level below `down_dir` stairs of level `parent`; return its id."""
+        lid = len(self.maps)
+        self.parent.append(parent)
+        self.left.append(None)
+        self.right.append(None)
+        self.maps.append(None)
+        (self.left if down_dir == 'left' else self.right)[parent] = lid
+        self.frontier.pop((parent, down_dir), None)
+        self.set_map(lid, game_map)
+        return lid
+
+    def set_map(self, lid, game_map):
+        self.maps[lid] = game_map
+        for st in (game_map.left, game_map.right):
+            if st and not st.game_map:
+                self.frontier[lid, st.down_dir] = None
+        self._lines = self._marked = None
+
+    def path(self, lid, down_dir=None):
+        """Directions of the down stairs from the top level to level `lid` (and further down `down_dir`), e.g.
+        'left/right'."""
+        path = [down_dir] if down_dir else []
+        while self.parent[lid] is not None:
+            parent = self.parent[lid]
+            path.append('left' if self.left[parent] == lid else 'right')
+            lid = parent
+        return '/'.join(reversed(path))
+
+    def layout(self, cur):
+        """Lines drawing the tree top down, one level per line, with level `cur` marked as `*id*` and down stairs that
+        haven't been taken yet as `?`; returns the lines and the index of the line of `cur`."""
+        if self._lines is None:
+            self._lines, self._rows = [], {}
+            stack = [(0, '', '')]   # level id (None for untaken stairs), prefix of its line, prefix of its children
+            while stack:
+                lid, first, rest = stack.pop()
+                if lid is None:
+                    self._lines.append(first + '?')
+                    continue
+                self._rows[lid] = len(self._lines)
+                self._lines.append(first + str(lid))
+                kids = []
+                for down_dir, children in (('left', self.left), ('right', self.right)):
+                    if children[lid] is not None:
+                        kids.append(children[lid])
+                    elif (lid, down_dir) in self.frontier:
+                        kids.append(None)
+                if len(kids) == 1:
+                    # a level with one way down continues in the same column
+                    stack.append((kids[0], rest, rest))
+                elif kids:
+                    stack.append((kids[1], rest + '└─', rest + '  '))
+                    stack.append((kids[0], rest + '├─', rest + '│ '))
+        if not self._marked or self._marked[0] != cur:
+            lines = list(self._lines)
+            row = self._rows[cur]
+            lines[row] = lines[row][:-len(str(cur))] + f'*{cur}*'
+            self._marked = cur, lines, row
+        return self._marked[1:]
@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-from random import random
+import time
 import tcod
 import traceback
 
@@ -8,12 +8,41 @@ from input_handlers import EventHandler
 from game_map import Color
 from actions import Impossible
 
+frame_time = 1 / 60     # the screen is presented at most this often
+
+
+def coalesce_motion(events):
+    """Yield `events`, dropping mouse motion that is immediately followed by more motion."""
+    motion = None
+    for event in events:
+        if isinstance(event, tcod.event.MouseMotion):
+            motion = event
+            continue
+        if motion:
+            yield motion
+            motion = None
+        yield event
+    if motion:
+        yield motion
+
 def game_loop(engine, console, context):
+    dirty = True
+    next_frame = 0
     while True:
-        engine.render(console=console, context=context)
+        if dirty and time.perf_counter() >= next_frame:
+            engine.render(console=console, context=context)
+            next_frame = time.perf_counter() + frame_time
+            dirty = False
 
-        for event in tcod.event.wait():
+        # block until there's input, or, if the screen is out of date, until the next frame is due
+        timeout = max(0, next_frame - time.perf_counter()) if dirty else None
+        for event in coalesce_motion(tcod.event.wait(timeout)):
+            mouse_loc = engine.mouse_loc
             action = engine.event_handler.dispatch(event)
+            if isinstance(event, tcod.event.MouseMotion) and not action:
+                dirty = dirty or engine.mouse_loc != mouse_loc
+                continue
+            dirty = True
             if isinstance(action, EventHandler):
                 engine = action.engine
                 engine.context = context
@@ -27,12 +56,13 @@ def game_loop(engine, console, context):
                     engine.messages.add(e.args[0], Color.impossible)
 
                 engine.handle_enemy_turns()
-                if random()>.5:
+                if engine.rng.combat.random()>.5:
                     engine.player.fighter.heal(2)
+                if engine.game_map:
+                    engine.game_map.make_turn()
 
             if engine.game_map:
                 engine.update_fov()
-                engine.game_map.make_turn()
 
 
 def main():
@@ -44,9 +74,9 @@ def main():
         engine.console = root_console
         try:
             game_loop(engine, root_console, context)
-        except Exception:
+        except Exception as e:
             traceback.print_exc()
-            engine.messages.add(traceback.format_exc(), Color.error)
+            engine.messages.add(''.join(traceback.format_exception_only(type(e), e)).strip(), Color.error)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,117 @@
+"""Speculative generation of the levels below the current one in worker processes.
+
+While the player explores a level, the maps behind its down stairs are generated in a process pool with a stub engine;
+when the player takes the stairs, the ready map is unpickled with the stub engine and player replaced by the real ones.
+Maps for the stairs that were not taken are dropped when the player leaves the level.
+"""
+import io
+import traceback
+import multiprocessing
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import entity
+from rng import RNG
+from savegame import Pickler, Unpickler
+
+
+class StubEngine:
+    """The parts of the Engine that level generation uses."""
+    game_map = None
+    time = 0
+
+    def __init__(self, level, total_levels, max_levels, specials, player, rng):
+        self.level = level
+        self.total_levels = total_levels
+        self.max_levels = max_levels
+        self.specials = specials
+        self.player = player
+        self.rng = rng
+
+
+def generate_level(level, total_levels, max_levels, specials, stairs_loc, seed, key):
+    """Run in a worker: generate the level at path `key` below stairs at `stairs_loc`, return it pickled with
+    references to the stub engine and player as persistent ids."""
+    from engine import new_map
+    player = entity.Player(None, *stairs_loc)
+    engine = StubEngine(level, total_levels, max_levels, dict.fromkeys(specials), player, RNG(seed))
+    with redirect_stdout(io.StringIO()):
+        m = new_map(engine, player, None, key)
+    new_specials = {k: v for k, v in engine.specials.items() if k not in specials}
+    f = io.BytesIO()
+    Pickler(f, {id(engine): ('engine',), id(player): ('player',)}).dump((m, new_specials))
+    return f.getvalue()
+
+
+class Pregenerator:
+    """Kept on the Engine; the pool and pending maps are not saved or copied. If the pool breaks (e.g. a worker died),
+    pre-generation is turned off and levels are generated when the player takes the stairs."""
+    max_workers = 2
+
+    def __init__(self):
+        self.pool = None
+        self.disabled = False
+        self.pending = {}   # down_dir => (current map, total_levels, future)
+
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def special_level_due(self, engine):
+        levels = entity.special_data.levels.get(engine.level + 2) or ()
+        return any(sl.id not in engine.specials for sl in levels)
+
+    def schedule(self, engine):
+        """Drop maps generated for other levels, start generating the ones below the current level."""
+        m = engine.game_map
+        for dir, (gm, _, future) in list(self.pending.items()):
+            if gm is not m:
+                future.cancel()
+                del self.pending[dir]
+        if self.disabled or self.special_level_due(engine):
+            return
+        for st in (m.left, m.right):
+            if st and not st.game_map and st.down_dir not in self.pending:
+                if not self.pool:
+                    self.pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+                args = (engine.level + 1, engine.total_levels, engine.max_levels, list(engine.specials), st.loc,
+                        engine.rng.seed, engine.level_key(engine.cur_node, st.down_dir))
+                try:
+                    self.pending[st.down_dir] = m, engine.total_levels, self.pool.submit(generate_level, *args)
+                except (BrokenProcessPool, RuntimeError):
+                    traceback.print_exc()
+                    self.pool.shutdown(wait=False, cancel_futures=True)
+                    self.pool = None
+                    self.disabled = True
+                    return
+
+    def adopt(self, engine, st):
+        """Return the map generated for stairs `st` of the current level, or None if there isn't a usable one."""
+        gm, total_levels, future = self.pending.pop(st.down_dir, (None, None, None))
+        if gm is not engine.game_map:
+            return
+        try:
+            data = future.result()
+        except Exception:
+            traceback.print_exc()
+            return
+        player = engine.player
+        m, specials = Unpickler(io.BytesIO(data), {('engine',): engine, ('player',): player}).load()
+
+        # the world may have changed since the map was started: unique specials placed elsewhere, or the last level
+        # with stairs generated
+        if specials.keys() & engine.specials.keys():
+            return
+        if (total_levels <= engine.max_levels) != (engine.total_levels <= engine.max_levels):
+            return
+
+        engine.specials.update(specials)
+        engine.total_levels += 1
+        m.up.game_map = engine.game_map
+        # register the real player with the map's entity set
+        m.entities.remove(player)
+        m.entities.add(player)
+        return m
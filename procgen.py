@@ -1,9 +1,10 @@
 from copy import copy
-from random import randint, random, choice, choices
+from collections import Counter
 from dataclasses import dataclass
+import numpy as np  # type: ignore
 import tcod
 
-from game_map import GameMap, Stairs
+from game_map import GameMap, Stairs, EntitySet
 import tile_types
 import entity
 from util import Loc
@@ -19,8 +20,14 @@ max_monsters_by_floor = [
    (6, 5),
 ]
 
+neighbours = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy]
+
+# rooms rejected by `generate_dungeon`, by reason
+rejected_rooms = Counter()
+
 class RectangularRoom:
     auspicious = 0
+    _inner2 = _walls = None     # cached coordinate arrays and mask, not saved
 
     def __init__(self, x, y, width, height):
         self.x1 = x
@@ -35,6 +42,9 @@ class RectangularRoom:
         x1,x2,y1,y2 = self.x1, self.x2, self.y1, self.y2
         return f'<{x1},{y1} {x2},{y2}>'
 
+    def __getstate__(self):
+        return {k: v for k, v in vars(self).items() if k not in ('_inner2', '_walls')}
+
     @property
     def center(self):
         center_x = int((self.x1 + self.x2) / 2)
@@ -45,9 +55,35 @@ class RectangularRoom:
     def inner(self):
         return slice(self.x1 + 1, self.x2), slice(self.y1 + 1, self.y2)
 
+    @property
+    def area(self):
+        """Slices of `locs()`."""
+        return slice(self.x1, self.x2), slice(self.y1, self.y2)
+
     def inner2(self):
         return Loc(self.x1+2, self.y1+2), Loc(self.x2-2, self.y2-2)
 
+    def inner2_coords(self):
+        """x and y arrays of `inner2_locs()`, in the same order."""
+        if self._inner2 is None:
+            p1, p2 = self.inner2()
+            ys, xs = np.mgrid[p1.y:p2.y, p1.x:p2.x]
+            self._inner2 = xs.ravel(), ys.ravel()
+        return self._inner2
+
+    def random_inner2_loc(self, rnd, exclude=()):
+        """Random location from `inner2_locs()` that is not in `exclude`, or None."""
+        xs, ys = self.inner2_coords()
+        for loc in exclude:
+            keep = (xs != loc.x) | (ys != loc.y)
+            xs, ys = xs[keep], ys[keep]
+        if len(xs):
+            n = rnd.randrange(len(xs))
+            return Loc(int(xs[n]), int(ys[n]))
+
+    def random_inner_loc(self, rnd):
+        return Loc(rnd.randint(self.x1 + 1, self.x2 - 1), rnd.randint(self.y1 + 1, self.y2 - 1))
+
     def __contains__(self, loc):
         return self.x1 <= loc.x <= self.x2 and self.y1 <= loc.y <= self.y2
 
@@ -62,6 +98,14 @@ class RectangularRoom:
             l.append(Loc(x, p2.y))
         return l
 
+    def wall_mask(self, shape):
+        """Boolean mask of `walls()` in a map of `shape`."""
+        if self._walls is None or self._walls.shape != shape:
+            m = self._walls = np.zeros(shape, dtype=bool)
+            m[self.x1:self.x2, [self.y1, self.y2]] = True
+            m[[self.x1, self.x2], self.y1:self.y2] = True
+        return self._walls
+
     def locs(self, check=None):
         """`check` func will result in early return"""
         l = []
@@ -115,18 +159,19 @@ def spawn(type, dungeon, engine, loc):
     if m.id:
         engine.specials[m.id] = m
 
+    rnd = engine.rng.spawn
     if isinstance(m, entity.Living):
-        items = get_entities_at_random(item_chances, randint(0,2), engine.level)
+        items = get_entities_at_random(item_chances, rnd.randint(0,2), engine.level, rnd)
         for i in items:
             m.inventory.add(i(engine))
         m.inventory.add(entity.LightningScroll(engine))
-        if random()>.5:
+        if rnd.random()>.5:
             m.asleep = -1
             #print('in spawn, adding', m, m.loc, m.asleep)
 
     # spawn a box with contents
     if isinstance(m, (entity.Box, entity.UndergroundSpace)):
-        items = get_entities_at_random(item_chances, randint(0,2), engine.level)
+        items = get_entities_at_random(item_chances, rnd.randint(0,2), engine.level, rnd)
         for i in items:
             if i not in (entity.Box, entity.UndergroundSpace):
                 m.inventory.add(i(engine))
@@ -158,7 +203,7 @@ enemy_chances = {
    14: [(E.InsuperableTroll, 40)],
 }
 
-def get_entities_at_random(weighted_chances_by_floor, number_of_entities, floor):
+def get_entities_at_random(weighted_chances_by_floor, number_of_entities, floor, rnd):
     entity_weighted_chances = {}
 
     for key, values in weighted_chances_by_floor.items():
@@ -172,40 +217,43 @@ def get_entities_at_random(weighted_chances_by_floor, number_of_entities, floor)
 
     entities = list(entity_weighted_chances.keys())
     entity_weighted_chance_values = list(entity_weighted_chances.values())
-    return choices(entities, weights=entity_weighted_chance_values, k=number_of_entities)
+    return rnd.choices(entities, weights=entity_weighted_chance_values, k=number_of_entities)
 
 def place_entities(room, dungeon, engine):
-    monsters = get_entities_at_random(enemy_chances, randint(0,2), engine.level)
-    items = get_entities_at_random(item_chances, randint(0,2), engine.level)
+    rnd = engine.rng.spawn
+    monsters = get_entities_at_random(enemy_chances, rnd.randint(0,2), engine.level, rnd)
+    items = get_entities_at_random(item_chances, rnd.randint(0,2), engine.level, rnd)
     from entity import Water
 
-    if random()>.9:
-        loc = Loc( randint(room.x1 + 1, room.x2 - 1), randint(room.y1 + 1, room.y2 - 1) )
+    if rnd.random()>.9:
+        loc = room.random_inner_loc(rnd)
         spawn(Water, dungeon, engine, loc)
 
     for e in monsters + items:
-        loc = Loc( randint(room.x1 + 1, room.x2 - 1), randint(room.y1 + 1, room.y2 - 1) )
-        if not any(loc==entity.loc for entity in dungeon.entities):
+        loc = room.random_inner_loc(rnd)
+        if not dungeon.get_entities_at_loc(loc):
             spawn(e, dungeon, engine, loc)
             if issubclass(e, entity.Living) and e.gen_companions:
                 odds, mn, mx = e.gen_companions
-                if random()>odds:
-                    n = randint(mn, mx)
+                if rnd.random()>odds:
+                    n = rnd.randint(mn, mx)
                     lst = dungeon.empty_lst(loc.adj_locs())[:n]
                     for loc in lst:
                         spawn(e, dungeon, engine, loc)
 
 def place_special(room, dungeon, engine, cls):
+    rnd = engine.rng.spawn
     for _ in range(50):
-        loc = Loc( randint(room.x1 + 1, room.x2 - 1), randint(room.y1 + 1, room.y2 - 1) )
-        if not any(loc==entity.loc for entity in dungeon.entities):
+        loc = room.random_inner_loc(rnd)
+        if not dungeon.get_entities_at_loc(loc):
             print("special cls", cls, loc)
             spawn(cls, dungeon, engine, loc)
             return
 
 def place_vertical(room, dungeon, engine, cls):
+    rnd = engine.rng.spawn
     for _ in range(50):
-        loc = Loc( randint(room.x1 + 1, room.x2 - 1), randint(room.y1 + 1, room.y2 - 1) )
+        loc = room.random_inner_loc(rnd)
         if loc not in (dungeon.left, dungeon.right, dungeon.up):
             print("vertial cls", cls, loc)
             spawn(cls, dungeon, engine, loc)
@@ -228,8 +276,8 @@ class Interval:
     def intersects_inner(self, o):
         return self.inner().intersects(o.inner())
 
-    def random(self):
-        return randint(self.a, self.b)
+    def random(self, rnd):
+        return rnd.randint(self.a, self.b)
 
     def __repr__(self):
         return f'<{self.a}->{self.b}>'
@@ -276,12 +324,12 @@ def l_line(a, b):
 def generate_special_dungeon(max_rooms, room_min_size, room_max_size, map_width, map_height, player, engine, up_map, special_level):
     if special_level.custom_map:
         dungeon = engine.custom_maps[special_level.custom_map]
-        dungeon.entities = {player}
+        dungeon.entities = EntitySet({player}, dungeon.tiles.shape)
         dungeon.level = engine.level+1
         print("dungeon.up", dungeon.up)
         print("engine", engine)
         if not dungeon.up:
-            dungeon.up = Stairs(engine.game_map.random_empty(), above_loc=player.loc)
+            dungeon.up = Stairs(engine.game_map.random_empty(engine.rng.map), above_loc=player.loc)
         dungeon.up.game_map = engine.game_map
     else:
         dungeon = GameMap(map_width, map_height, {player}, engine.level+1)
@@ -308,6 +356,7 @@ def generate_special_dungeon(max_rooms, room_min_size, room_max_size, map_width,
 
 
 def generate_dungeon(max_rooms, room_min_size, room_max_size, map_width, map_height, player, engine, up_map):
+    rnd = engine.rng.map
     rooms = []
     dungeon = GameMap(map_width, map_height, {player}, engine.level+1)
 
@@ -323,25 +372,31 @@ def generate_dungeon(max_rooms, room_min_size, room_max_size, map_width, map_hei
                  [(3,16), (3+x_var,16+5)],
                 ]
 
-    tun_locs = set()
+    tunnels = np.zeros(dungeon.tiles.shape, dtype=bool)
+    near_tunnels = np.zeros(dungeon.tiles.shape, dtype=bool)  # next to a tunnel tile
     def adj(tun):
-        """Adjacent to another tunnel."""
-        for x,y in tun:
-            intr = Loc(x,y).adj() & tun_locs
-            if intr:
-                return Loc(*tuple(intr)[0])
-        return False
+        """Adjacent to another tunnel: return the tunnel tile next to the first such tile of `tun`."""
+        xs, ys = np.array(tun).T
+        near = near_tunnels[xs, ys]
+        if not near.any():
+            return False
+        n = near.argmax()
+        x, y = int(xs[n]), int(ys[n])
+        for dx, dy in neighbours:
+            if tunnels[x+dx, y+dy]:
+                return Loc(x+dx, y+dy)
 
     rnum = 1
     for r in range(max_rooms):
-        if random()>.9:
+        if rnd.random()>.9:
+            rejected_rooms['skipped'] += 1
             continue
-        room_width = randint(room_min_size, room_max_size)
-        room_height = randint(room_min_size, room_max_size)
+        room_width = rnd.randint(room_min_size, room_max_size)
+        room_height = rnd.randint(room_min_size, room_max_size)
 
         c1, c2 = rm_starts[r]
-        x = randint(c1[0], c2[0])
-        y = randint(c1[1], c2[1])
+        x = rnd.randint(c1[0], c2[0])
+        y = rnd.randint(c1[1], c2[1])
 
         room_width = env(room_width, dungeon.width-x-1)
         room_height = env(room_height, dungeon.height-y-1)
@@ -349,6 +404,7 @@ def generate_dungeon(max_rooms, room_min_size, room_max_size, map_width, map_hei
         new_room = RectangularRoom(x, y, room_width, room_height)
 
         if any(new_room.intersects(other_room) for other_room in rooms):
+            rejected_rooms['intersects'] += 1
             continue
 
 
@@ -367,6 +423,7 @@ def generate_dungeon(max_rooms, room_min_size, room_max_size, map_width, map_hei
                 if adj(tun):
                     tun = l_line(r1.center, r2.center)
                     if adj(tun):
+                        rejected_rooms['tunnel adjacent'] += 1
                         continue
 
             if not tun:
@@ -379,7 +436,7 @@ def generate_dungeon(max_rooms, room_min_size, room_max_size, map_width, map_hei
             elif intr:
                 x1,x2 = r1.closest_x(r2)
                 for n in range(50):
-                    y = intr.random()
+                    y = intr.random(rnd)
                     i = adj([(x1,y),(x2,y)])
                     if not i: break
                     if i.y>y: y-=1
@@ -391,34 +448,35 @@ def generate_dungeon(max_rooms, room_min_size, room_max_size, map_width, map_hei
                     if adj(tun):
                         tun = l_line(r1.center, r2.center)
                         if adj(tun):
+                            rejected_rooms['tunnel adjacent'] += 1
                             continue
 
                 tun = tun or line(x1, x2, y=y)
             elif intr2:
-                x = intr2.random()
+                x = intr2.random(rnd)
                 y1,y2 = r1.closest_y(r2)
                 tun = line(y1, y2, x=x)
-            if set(tun) & tun_locs:
+            xs, ys = np.array(tun).T
+            if tunnels[xs, ys].any():
+                rejected_rooms['tunnel crossing'] += 1
                 continue
 
-            if random()>.5:
+            if rnd.random()>.5:
                 for x,y in tun:
                     if x in (r1.x1, r1.x2) or y in (r1.y1,r1.y2):
                         d = entity.Door(engine, x, y)
-                        if random()>.8:
+                        if rnd.random()>.8:
                             d.locked = True
                         dungeon.entities.add(d)
                         break
-            for x,y in tun:
-                dungeon.tiles[x,y] = tile_types.floor
-                tun_locs.add((x,y))
-                r1walls = set(r1.walls())
-                r2walls = set(r2.walls())
-                l = Loc(x,y)
-                if l in r1walls:
-                    r1.entries.append(l)
-                elif l in r2walls:
-                    r2.entries.append(l)
+            dungeon.tiles[xs, ys] = tile_types.floor
+            tunnels[xs, ys] = True
+            for dx, dy in neighbours:
+                near_tunnels[xs+dx, ys+dy] = True
+            in_r1 = r1.wall_mask(tunnels.shape)[xs, ys]
+            in_r2 = r2.wall_mask(tunnels.shape)[xs, ys] & ~in_r1
+            r1.entries.extend(Loc(int(x), int(y)) for x, y in zip(xs[in_r1], ys[in_r1]))
+            r2.entries.extend(Loc(int(x), int(y)) for x, y in zip(xs[in_r2], ys[in_r2]))
 
         dungeon.tiles[new_room.inner] = tile_types.floor
         place_entities(new_room, dungeon, engine)
@@ -434,28 +492,27 @@ def generate_dungeon(max_rooms, room_min_size, room_max_size, map_width, map_hei
     create_stairs(engine, dungeon, rooms, up_map)
     engine.total_levels += 1
     dungeon.rooms = rooms
-    hidden_room(dungeon, rooms, map_width, map_height)
+    hidden_room(dungeon, rooms, map_width, map_height, rnd)
     return dungeon
 
 def create_stairs(engine, dungeon, rooms, up_map):
+    rnd = engine.rng.map
     locs = ()
     if engine.total_levels <= engine.max_levels:
         loc = loc2 = 0
-        if random()>.1:
+        if rnd.random()>.1:
             for _ in range(50):
-                r = choice(rooms)
-                locs = r.inner2_locs()
-                if locs:
-                    loc = choice(locs)
+                l = rnd.choice(rooms).random_inner2_loc(rnd)
+                if l:
+                    loc = l
                     if not dungeon.get_entities_at_loc(loc):
                         dungeon.tiles[loc.x, loc.y] = tile_types.down_stairs
                         break
-        if not loc or random()>.1:
+        if not loc or rnd.random()>.1:
             for _ in range(50):
-                r = choice(rooms)
-                locs = list(set(r.inner2_locs()) - {loc})
-                if locs:
-                    loc2 = choice(locs)
+                l = rnd.choice(rooms).random_inner2_loc(rnd, [loc] if loc else ())
+                if l:
+                    loc2 = l
                     if not dungeon.get_entities_at_loc(loc2):
                         dungeon.tiles[loc2.x, loc2.y] = tile_types.down_stairs
                         break
@@ -465,15 +522,13 @@ def create_stairs(engine, dungeon, rooms, up_map):
             dungeon.left, dungeon.right = Stairs(loc, down_dir='left'), Stairs(loc2, down_dir='right')
             print('placing left and right stairs')
         else:
-            dir = choice(('left','right'))
+            dir = rnd.choice(('left','right'))
             setattr(dungeon, dir, Stairs(loc or loc2, down_dir=dir))
 
     if engine.level > 0:
         for _ in range(50):
-            r = choice(rooms)
-            locs2 = list(set(r.inner2_locs()) - set(locs))
-            if locs2:
-                loc = choice(locs2)
+            loc = rnd.choice(rooms).random_inner2_loc(rnd, [l for l in locs if l])
+            if loc:
                 dungeon.tiles[loc.x, loc.y] = tile_types.up_stairs
                 dungeon.up = Stairs(loc, above_loc=engine.player.loc, game_map=up_map)
                 break
@@ -495,16 +550,15 @@ def hidden_room_tunnel(dungeon, room):
     if lst: return lst
 
 
-def hidden_room(dungeon, rooms, map_width, map_height):
+def hidden_room(dungeon, rooms, map_width, map_height, rnd):
     # if not random()>.75:
         # return
     for _ in range(50):
-        x,y = randint(3,map_width-3), randint(3,map_height-3)
+        x,y = rnd.randint(3,map_width-3), rnd.randint(3,map_height-3)
         r = RectangularRoom(x, y, 3, 3)
         if any(r.intersects(_r) for _r in rooms):
             continue
-        locs = r.locs()
-        if not any(dungeon.walkable(l) for l in locs):
+        if not dungeon.tiles['walkable'][r.area].any():
             lst = hidden_room_tunnel(dungeon, r)
             if not lst:
                 continue
@@ -525,10 +579,10 @@ def env(val, max, min=0):
         val = min
     return val
 
-def tunnel_between(start, end):
+def tunnel_between(start, end, rnd):
     x1, y1 = start
     x2, y2 = end
-    if random() < 0.5:
+    if rnd.random() < 0.5:
         corner_x, corner_y = x2, y1
 
     else:
@@ -0,0 +1,32 @@
+"""Random number streams of a game, all derived from one world seed.
+
+`map` and `spawn` are seeded for every level from the level's path in the level tree while the level is generated, and
+so is `world`, which entities may draw from when they are created; a level is generated the same way whatever happened
+before it was visited, in this process or in a worker (see `pregen`). Outside of level generation `map` and `spawn` are
+the game-long `world` stream, so that spawning during the game (e.g. a Gremlin's clone) doesn't depend on where the last
+level was generated; `combat`, `ai` and `world` (everything else) run for the whole game.
+"""
+import random
+
+
+class RNG:
+    def __init__(self, seed=None):
+        self.seed = random.getrandbits(64) if seed is None else seed
+        self.combat = self.stream('combat')
+        self.ai = self.stream('ai')
+        self.game_world = self.world = self.stream('world')
+        self.end_level()
+
+    def stream(self, *key):
+        """New `random.Random` seeded with the world seed and `key`."""
+        return random.Random(':'.join(map(str, (self.seed,) + key)))
+
+    def start_level(self, key):
+        """Switch to the level generation streams of the level at path `key`."""
+        self.map = self.stream('map', key)
+        self.spawn = self.stream('spawn', key)
+        self.world = self.stream('world', key)
+
+    def end_level(self):
+        """Switch back to the game-long streams after generating a level."""
+        self.map = self.spawn = self.world = self.game_world
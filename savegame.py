@@ -0,0 +1,133 @@
+"""Saved game is a directory with one lzma-compressed pickle per level and a manifest.
+
+The manifest holds the engine (level tree, messages, quests, ...) and the player; every level blob holds one `GameMap`
+and its entities. References between them (engine, player, other levels, entities of other levels) are stored as
+persistent ids, so that a level blob only has to be rewritten when the level has changed, i.e. when the player has been
+on it since the last save.
+
+Saves of older versions were a single pickle of the whole engine; they can't be read any more. Saving over one moves it
+aside to `<filename>.old`.
+"""
+import os
+import lzma
+import pickle
+
+from game_map import GameMap, EntitySet
+
+MANIFEST = 'manifest'
+
+
+class OldSaveError(Exception):
+    pass
+
+
+class SaveJournal:
+    """Tracks levels that were changed since the last save; kept on the Engine, but not saved."""
+    def __init__(self, filename=None, saved=None):
+        self.filename = filename
+        self.saved = saved or {}    # level id => entities in the order they were written
+        self.changed = set()
+
+    def level_changed(self, lid):
+        self.changed.add(lid)
+
+
+class Pickler(pickle.Pickler):
+    def __init__(self, file, refs):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.refs = refs
+
+    def persistent_id(self, obj):
+        return self.refs.get(id(obj))
+
+class Unpickler(pickle.Unpickler):
+    def __init__(self, file, objects):
+        super().__init__(file)
+        self.objects = objects
+
+    def persistent_load(self, pid):
+        return self.objects[pid]
+
+
+def level_maps(engine):
+    return {lid: m for lid, m in enumerate(engine.tree.maps) if m}
+
+def level_fn(filename, id):
+    return os.path.join(filename, f'level-{id}')
+
+def dump(fn, objects, refs):
+    """Pickle `objects` one after another into `fn`, replacing the file only when done."""
+    with lzma.open(fn + '.tmp', 'wb') as f:
+        for o in objects:
+            Pickler(f, refs).dump(o)
+    os.replace(fn + '.tmp', fn)
+
+def check_format(filename):
+    if os.path.isfile(filename):
+        raise OldSaveError(f'{filename} is a save of an older version of the game, which can no longer be loaded')
+
+def save(engine, filename):
+    if os.path.isfile(filename):
+        os.replace(filename, filename + '.old')
+        print(f'{filename} of an older version of the game moved to {filename}.old')
+    os.makedirs(filename, exist_ok=True)
+    journal = engine.journal
+    if journal.filename != os.path.abspath(filename):
+        journal = SaveJournal(os.path.abspath(filename))
+    maps = level_maps(engine)
+
+    refs = {id(engine): ('engine',), id(engine.player): ('player',)}
+    for lid, m in maps.items():
+        refs[id(m)] = 'map', lid
+        refs[id(m.entities)] = 'entities', lid
+
+    changed = journal.changed | {engine.cur_node}
+    for lid, m in maps.items():
+        if lid in changed or lid not in journal.saved:
+            engine.hibernator.restore(engine, lid)
+            entities = list(m.entities)
+            dump(level_fn(filename, lid), [(vars(m), entities)], refs)
+            journal.saved[lid] = entities
+
+    # entities on levels that are referenced from the engine, e.g. by quests
+    for lid, entities in journal.saved.items():
+        for n, e in enumerate(entities):
+            if e is not None:   # entities of levels spilled by `Hibernator`
+                refs.setdefault(id(e), ('entity', lid, n))
+
+    state = {k: v for k, v in vars(engine).items() if k not in ('journal', 'custom_maps')}
+    header = dict(levels=list(maps), engine_cls=type(engine), player_cls=type(engine.player))
+    dump(os.path.join(filename, MANIFEST), (header, (state, vars(engine.player))), refs)
+
+    for fn in os.listdir(filename):
+        if fn.startswith('level-') and fn[6:] not in {str(lid) for lid in maps}:
+            os.remove(os.path.join(filename, fn))
+    journal.changed = set()
+    engine.journal = journal
+
+def load(filename):
+    check_format(filename)
+    with lzma.open(os.path.join(filename, MANIFEST), 'rb') as f:
+        header = pickle.load(f)
+        engine = header['engine_cls'].__new__(header['engine_cls'])
+        player = header['player_cls'].__new__(header['player_cls'])
+        objects = {('engine',): engine, ('player',): player}
+        for lid in header['levels']:
+            objects['map', lid] = GameMap.__new__(GameMap)
+            objects['entities', lid] = EntitySet()
+
+        saved = {}
+        for lid in header['levels']:
+            with lzma.open(level_fn(filename, lid), 'rb') as lf:
+                state, entities = Unpickler(lf, objects).load()
+            objects['map', lid].__dict__.update(state)
+            objects['entities', lid].__setstate__((entities, (state['width'], state['height'])))
+            saved[lid] = entities
+            objects.update((('entity', lid, n), e) for n, e in enumerate(entities))
+
+        engine_state, player_state = Unpickler(f, objects).load()
+    engine.__dict__.update(engine_state)
+    player.__dict__.update(player_state)
+    engine.custom_maps = {}
+    engine.journal = SaveJournal(os.path.abspath(filename), saved)
+    return engine
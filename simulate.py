@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""Run the game without a window, with the player driven by a bot, and report turns per second.
+
+    ./simulate.py --turns 5000 --bot stairs --seed 1
+"""
+import io
+import sys
+import time
+import argparse
+from collections import defaultdict
+from contextlib import redirect_stdout
+
+from engine import new_game
+from actions import BumpAction, WaitAction, Impossible
+from input_handlers import dir_keys
+from util import Loc
+import entity
+
+
+class Bot:
+    """Bot policy: returns the same actions the EventHandler would return for the player, or None for commands that
+    don't take a turn (e.g. taking the stairs)."""
+    def __init__(self, engine):
+        self.engine = engine
+        self.rnd = engine.rng.stream('bot')
+
+    @property
+    def player(self):
+        return self.engine.player
+
+    def get_action(self):
+        raise NotImplementedError
+
+    def random_step(self):
+        return BumpAction(Loc(*self.rnd.choice(list(dir_keys.values()))))
+
+class RandomBot(Bot):
+    """Walks around randomly and takes the stairs down when it happens to step on them."""
+    def get_action(self):
+        m = self.engine.game_map
+        if self.player.loc in (s.loc for s in (m.left, m.right) if s):
+            self.engine.down()
+            return
+        return self.random_step()
+
+class StairsBot(RandomBot):
+    """Walks to the nearest down stairs, fighting anything in the way, opening doors."""
+    def get_action(self):
+        m = self.engine.game_map
+        loc = self.player.loc
+        stairs = [s for s in (m.left, m.right) if s]
+        if not stairs or loc in (s.loc for s in stairs):
+            return super().get_action()
+
+        target = min(stairs, key=lambda s: loc.dist(s.loc))
+        path = self.player.get_path_to(target.loc)
+        if not path:
+            return self.random_step()
+        door = m.entity(path[0], entity.Door)
+        if door and door.closed:
+            if door.locked:
+                return self.random_step()
+            door.toggle()
+            return
+        return BumpAction(loc.dir_to(path[0]))
+
+bots = dict(random=RandomBot, stairs=StairsBot)
+
+
+class Simulation:
+    phases = 'player', 'enemies', 'map', 'fov'
+
+    def __init__(self, engine, bot_cls):
+        self.engine = engine
+        self.bot = bot_cls(engine)
+        self.timings = defaultdict(float)
+        self.turns = 0
+
+    def player_action(self):
+        """Same checks as `EventHandler.ev_keydown`."""
+        p = self.engine.player
+        if p.level.requires_level_up:
+            p.level.increase_max_hp()
+        if p.ap < 1 or p.asleep > 0 or p.paralized > 0:
+            return WaitAction()
+        action = self.bot.get_action()
+        if action:
+            action.init(self.engine, p)
+            p.ap -= 1
+        return action
+
+    def turn(self):
+        """One iteration of `main.game_loop` for a single event."""
+        engine = self.engine
+        t = time.perf_counter
+        t0 = t()
+        action = self.player_action()
+        if action:
+            try:
+                action.perform()
+            except Impossible as e:
+                engine.messages.add(e.args[0])
+        t1 = t()
+        if action:
+            engine.handle_enemy_turns()
+            if engine.rng.combat.random()>.5:
+                engine.player.fighter.heal(2)
+        t2 = t()
+        if action:
+            engine.game_map.make_turn()
+        t3 = t()
+        engine.update_fov()
+        t4 = t()
+        for name, a, b in zip(self.phases, (t0, t1, t2, t3), (t1, t2, t3, t4)):
+            self.timings[name] += b - a
+        self.turns += 1
+
+    def run(self, turns):
+        while self.turns < turns and self.engine.player.is_alive:
+            self.turn()
+
+    def report(self, file=sys.stdout):
+        total = sum(self.timings.values())
+        print(f'{self.turns} turns in {total:.3f}s, {self.turns/total:.0f} turns/sec, level {self.engine.level+1}, '
+              f'player {"alive" if self.engine.player.is_alive else "dead"}', file=file)
+        for name in self.phases:
+            v = self.timings[name]
+            print(f'  {name:10} {v*1000:10.1f} ms {v/self.turns*1e6:10.1f} us/turn {v/total*100:5.1f}%', file=file)
+
+
+def simulate(turns, bot='stairs', maps_filename='custom_maps.npz', verbose=False, immortal=False, seed=None):
+    out = sys.stdout if verbose else io.StringIO()
+    with redirect_stdout(out):
+        engine = new_game(maps_filename, seed)[0]
+        if immortal:
+            f = engine.player.fighter
+            f.max_hp = f.hp = 10**9
+        sim = Simulation(engine, bots[bot])
+        sim.run(turns)
+    return sim
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--turns', type=int, default=2000)
+    parser.add_argument('--bot', choices=bots, default='stairs')
+    parser.add_argument('--seed', type=int, help='world seed; the same seed and bot replay the same game')
+    parser.add_argument('--maps', default='custom_maps.npz')
+    parser.add_argument('--immortal', action='store_true', help='player has a billion hit points')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show game output')
+    args = parser.parse_args()
+    simulate(args.turns, args.bot, args.maps, args.verbose, args.immortal, args.seed).report()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Timed status effects of living entities.
+
+A status is an attribute of `Living` with the number of turns it has left: 0 when it's not active, -1 when it lasts
+until it's set to 0. Only its expiry time (in `Engine.time`) is stored, in `Entity.statuses`; the entity set of the map
+keeps a timer heap of the expiries and of the next ticks of damage-over-time effects, so that an entity without active
+statuses costs nothing per turn.
+"""
+
+
+class Status:
+    """Descriptor of a status; `tick()` is called every turn while it's active if `ticks` is set, `end()` when it runs
+    out."""
+    ticks = False
+    end_message = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, e, owner=None):
+        if e is None:
+            return self
+        expiry = e.statuses.get(self.name)
+        if expiry is None:
+            return 0
+        if expiry < 0:
+            return -1
+        return max(0, expiry - e.engine.time)
+
+    def __set__(self, e, turns):
+        statuses = e.__dict__.setdefault('statuses', {})
+        if turns > 0:
+            statuses[self.name] = e.engine.time + turns
+        elif turns < 0:
+            statuses[self.name] = -1
+        else:
+            statuses.pop(self.name, None)
+        e.status_changed(self.name)
+
+    def next_event(self, e):
+        """Game time at which `e` is due for this status, or None if it has no timer."""
+        expiry = e.statuses.get(self.name)
+        if expiry is None or expiry < 0:
+            return None
+        return e.engine.time + 1 if self.ticks else expiry
+
+    def update(self, e, engine):
+        """`e` is due for this status: tick it, and end it if it has run out."""
+        if not e.is_alive or self.name not in e.statuses:
+            return
+        left = self.__get__(e)
+        if self.ticks:
+            self.tick(e, engine, left)
+        if not left and self.name in e.statuses and e.is_alive:
+            del e.statuses[self.name]
+            self.end(e, engine)
+        # the timers of `e` in the entity sets of other levels (the player is in all of them) have to follow
+        e.status_changed(self.name)
+
+    def tick(self, e, engine, left):
+        pass
+
+    def end(self, e, engine):
+        if self.end_message:
+            engine.messages.add(self.end_message.format(e))
+
+
+class Levitating(Status):
+    end_message = '{} floats down'
+
+    def end(self, e, engine):
+        e.vloc = 0
+        super().end(e, engine)
+
+class Asleep(Status):
+    end_message = '{} wakes up'
+
+class Blinded(Status):
+    end_message = '{} can see again'
+
+class Paralized(Status):
+    end_message = '{} can move again'
+
+class Poisoned(Status):
+    ticks = True
+    end_message = '{} feels better'
+
+    def tick(self, e, engine, left):
+        dmg = engine.rng.combat.randint(2,6)
+        e.fighter.take_damage(dmg)
+        engine.messages.add(f'{e} takes {dmg}hp damage from poison')
+        if engine.rng.combat.random()>0.999:
+            engine.messages.add(f'{e} dies of poison')
+            e.fighter.die()
+
+class TurningToStone(Status):
+    ticks = True
+    end_message = '{} is now STONE ...'
+
+    def tick(self, e, engine, left):
+        if left:
+            engine.messages.add(f'{e} is turning to stone ...')
+
+    def end(self, e, engine):
+        super().end(e, engine)
+        e.fighter.die()
@@ -0,0 +1,80 @@
+"""Regression checks for level hibernation, run with: python -m pytest test_hibernate.py"""
+import io
+import os
+import tempfile
+from contextlib import redirect_stdout
+
+import numpy as np  # type: ignore
+
+import bench
+import engine as E
+from hibernate import Hibernator
+
+
+def ascend(engine, levels):
+    with redirect_stdout(io.StringIO()):
+        for _ in range(levels):
+            engine.player.loc = engine.game_map.up.loc
+            engine.up()
+
+def go_around(engine):
+    bench.descend(engine, 6)
+    ascend(engine, 6)
+    bench.descend(engine, 6)
+    ascend(engine, 6)
+    assert engine.hibernator.spilled
+
+def snapshot(m, player):
+    """Tiles, explored mask and entities (type, location) of level `m`, which is left compacted if it was."""
+    compacted = m.compacted
+    m.expand()
+    entities = sorted((type(e).__name__, tuple(e.loc) if e.loc else None) for e in m.entities if e is not player)
+    state = m.tiles.copy(), m.explored.copy(), entities
+    if compacted:
+        m.compact()
+    return state
+
+def assert_same(a, b):
+    assert (a[0] == b[0]).all()
+    assert (a[1] == b[1]).all()
+    assert a[2] == b[2]
+
+def test_spill_again_after_save(monkeypatch):
+    """Levels are spilled, restored and spilled again after a save and after a load, and come back as they were."""
+    monkeypatch.setattr(Hibernator, 'resident', 1)
+    before_spill = {}
+    checked = []
+    spill, restore = Hibernator.spill, Hibernator.restore
+    def checked_spill(self, engine, lid):
+        before_spill[lid] = snapshot(engine.tree.maps[lid], engine.player)
+        spill(self, engine, lid)
+    def checked_restore(self, engine, lid):
+        spilled = lid in self.spilled
+        restore(self, engine, lid)
+        if spilled:
+            assert_same(snapshot(engine.tree.maps[lid], engine.player), before_spill.pop(lid))
+            checked.append(lid)
+    monkeypatch.setattr(Hibernator, 'spill', checked_spill)
+    monkeypatch.setattr(Hibernator, 'restore', checked_restore)
+
+    with redirect_stdout(io.StringIO()):
+        engine = E.new_game(bench.MAPS, bench.SEED)[0]
+    bench.descend(engine, 8)
+    with tempfile.TemporaryDirectory() as d:
+        fn, maps_fn = os.path.join(d, 'game.sav'), os.path.join(d, bench.MAPS)
+        engine.save_as(fn, maps_fn)
+        ascend(engine, 6)
+        go_around(engine)
+        engine.save_as(fn, maps_fn)
+        for lid in engine.tree:
+            engine.hibernator.restore(engine, lid)
+        saved = [snapshot(m, engine.player) for m in engine.tree.maps]
+        with redirect_stdout(io.StringIO()):
+            engine = E.load_game(fn, maps_fn)
+        for lid in engine.tree:
+            engine.hibernator.restore(engine, lid)
+        for a, m in zip(saved, engine.tree.maps):
+            assert_same(a, snapshot(m, engine.player))
+        go_around(engine)
+        engine.save_as(fn, maps_fn)
+    assert len(set(checked)) > 1
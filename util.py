@@ -1,16 +1,20 @@
 
-from copy import copy
+_interned = {}  # (x, y) => Loc, shared by the results of `Loc.adj_locs()`
+
 class Loc:
+    """Map location; equal to and hashed like the tuple (x, y), so either can be used as a key. Not to be modified in
+    place: `adj_locs()` returns interned instances."""
     __slots__ = ('x', 'y')
     def __init__(self, x, y):
         self.x, self.y = x,y
 
     def __iter__(self):
-        yield self.x
-        yield self.y
+        return iter((self.x, self.y))
 
     def __lt__(self, o):
-        return tuple(self) < tuple(o)
+        if type(o) is Loc:
+            return (self.x, self.y) < (o.x, o.y)
+        return (self.x, self.y) < tuple(o)
 
     def rect(self, max_x, max_y, width, height):
         l = []
@@ -27,13 +31,19 @@ class Loc:
         return l
 
     def adj(self):
-        x,y=self
-        return set([(x+1,y),(x-1,y),(x,y+1),(x,y-1), (x+1,y+1), (x-1,y-1), (x+1,y-1), (x-1,y+1)])
+        # a set display, in the same order as ever: the order of insertion decides the order of iteration
+        x,y = self.x, self.y
+        return {(x+1,y),(x-1,y),(x,y+1),(x,y-1), (x+1,y+1), (x-1,y-1), (x+1,y-1), (x-1,y+1)}
 
     def adj_locs(self, include_self=False):
-        l = [Loc(*tup) for tup in self.adj()]
+        l = []
+        for t in self.adj():
+            loc = _interned.get(t)
+            if loc is None:
+                loc = _interned[t] = Loc(*t)
+            l.append(loc)
         if include_self:
-            l.append(copy(self))
+            l.append(Loc(self.x, self.y))
         return l
 
     def mod(self, mx=0, my=0, mult=1):
@@ -50,26 +60,28 @@ class Loc:
         return Loc(self.x+mod.x, self.y+mod.y)
 
     def dir_to(self, loc):
-        return Loc(loc.x - self.x, loc.y - self.y
-)
+        return Loc(loc.x - self.x, loc.y - self.y)
+
     def dist(self, loc):
         dx = loc.x - self.x
         dy = loc.y - self.y
         return max(abs(dx), abs(dy))  # Chebyshev distance.
 
     def __getitem__(self, idx):
-        return tuple(self)[idx]
+        return (self.x, self.y)[idx]
 
     def __repr__(self):
         return f'<{self.x},{self.y}>'
 
     def __eq__(self, o):
+        if type(o) is Loc:
+            return self.x == o.x and self.y == o.y
         # doesn't work for opening doors???
         # return isinstance(o, self.__class__) and o and tuple(self)==tuple(o)
-        return o and tuple(self)==tuple(o)
+        return o and (self.x, self.y) == tuple(o)
 
     def __hash__(self):
-        return hash(tuple(self))
+        return hash((self.x, self.y))
 
     def opposite(self):
         return Loc(-self.x, -self.y)